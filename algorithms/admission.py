@@ -0,0 +1,132 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from monitoring import metrics
+
+load_dotenv()
+
+IN_FLIGHT = metrics.gauge(
+    "admission_in_flight",
+    "Recommendation computations currently admitted, per admission class",
+    ("branch",),
+)
+QUEUE_DEPTH = metrics.gauge(
+    "admission_queue_depth",
+    "Recommendation requests waiting for a slot, per admission class",
+    ("branch",),
+)
+REJECTED = metrics.counter(
+    "admission_rejected_total",
+    "Recommendation requests shed with 503: queue full or queue deadline exceeded",
+    ("branch", "reason"),
+)
+QUEUE_WAIT = metrics.histogram(
+    "admission_wait_seconds",
+    "Time admitted requests spent queued for a slot",
+    ("branch",),
+)
+
+DEFAULT_LIMITS = {
+    "concurrency": int(os.getenv("ADMISSION_CONCURRENCY", 16)),
+    "queue": int(os.getenv("ADMISSION_QUEUE_SIZE", 64)),
+    "timeoutMs": float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", 1000)),
+}
+# Per admission class overrides, e.g. ADMISSION_LIMITS='{"heavy": {"concurrency": 4, "queue": 16, "timeoutMs": 300}}'
+CLASS_LIMITS = json.loads(os.getenv("ADMISSION_LIMITS") or "{}")
+
+
+class AdmissionLane:
+    """Concurrency limit with a bounded FIFO wait queue for one admission class"""
+
+    def __init__(self, branch: str, concurrency: int, queue: int, timeout_ms: float):
+        self.branch = branch
+        self.concurrency = concurrency
+        self.queue_size = queue
+        self.timeout = timeout_ms / 1000
+        self.active = 0
+        self._waiters = deque()
+
+    def reject(self, reason: str):
+        REJECTED.inc(self.branch, reason)
+        raise HTTPException(
+            status_code=503,
+            detail=f"Too many '{self.branch}' recommendation requests, retry shortly.",
+            headers={"Retry-After": str(max(1, math.ceil(self.timeout)))},
+        )
+
+    async def acquire(self, timeout: float = math.inf):
+        """`timeout` (seconds) shortens the class's queue timeout, e.g. to a request's remaining latency budget"""
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            IN_FLIGHT.set(self.active, self.branch)
+            return
+        if len(self._waiters) >= self.queue_size:
+            self.reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        QUEUE_DEPTH.set(len(self._waiters), self.branch)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=max(min(self.timeout, timeout), 0))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended: pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            QUEUE_DEPTH.set(len(self._waiters), self.branch)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.reject("deadline")
+        QUEUE_WAIT.observe(time.perf_counter() - started, self.branch)
+
+    def release(self):
+        """Hands the slot to the oldest waiter, or frees it"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            QUEUE_DEPTH.set(len(self._waiters), self.branch)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+        IN_FLIGHT.set(self.active, self.branch)
+
+
+class AdmissionController:
+    """
+    Bounds the recommendation computations running at once, per admission class
+    (guest_popular, guest_content, cold_start, light, heavy). Requests beyond
+    the limit wait in a bounded queue; when it is full, or a request waited
+    longer than its class's timeout, it is shed at once with 503 and Retry-After
+    instead of slowing down everyone else.
+    """
+
+    def __init__(self):
+        self.lanes: Dict[str, AdmissionLane] = {}
+
+    def lane(self, branch: str) -> AdmissionLane:
+        lane = self.lanes.get(branch)
+        if lane is None:
+            limits = {**DEFAULT_LIMITS, **CLASS_LIMITS.get(branch, {})}
+            lane = self.lanes[branch] = AdmissionLane(branch, limits["concurrency"], limits["queue"], limits["timeoutMs"])
+        return lane
+
+    @asynccontextmanager
+    async def admit(self, branch: str, timeout: float = math.inf):
+        lane = self.lane(branch)
+        await lane.acquire(timeout)
+        try:
+            yield
+        finally:
+            lane.release()
@@ -0,0 +1,118 @@
+import numpy as np
+from scipy import sparse
+
+
+class RandomProjectionLSH:
+    """
+    Approximate cosine nearest neighbours over the rows of a (sparse) matrix.
+
+    Each of `n_tables` hash tables signs `n_bits` random hyperplane projections
+    into one integer code. Features are first hashed with random signs into
+    `hash_width` columns, so the hyperplanes take `hash_width` rows whatever
+    the vocabulary size (hashing roughly preserves cosine similarity). Each
+    table stores the row ids sorted by code so a bucket is a contiguous slice
+    found with `searchsorted`. Queries probe their own bucket
+    plus the `n_probes` buckets reached by flipping the least certain bits, then
+    rerank the candidates with exact cosine similarity.
+
+    Build time and memory are linear in the number of rows. More tables or
+    probes raise recall at the cost of more candidates to rerank; more bits make
+    buckets smaller, which speeds up queries but lowers recall.
+    """
+
+    def __init__(self, n_tables: int = 16, n_bits: int = 10, n_probes: int = 2, hash_width: int = 1024,
+                 random_state: int = 42, chunk_size: int = 50000):
+        if not 1 <= n_bits <= 62:
+            raise ValueError("n_bits must be between 1 and 62")
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.n_probes = n_probes
+        self.hash_width = hash_width
+        self.random_state = random_state
+        self.chunk_size = chunk_size
+        self.matrix = None
+        self.feature_hasher = None
+        self.planes = None
+        self.sorted_rows = None
+        self.sorted_codes = None
+        self._bit_values = np.left_shift(np.int64(1), np.arange(n_bits, dtype=np.int64))
+
+    def fit(self, matrix):
+        """Index the rows of `matrix`, which are expected to be L2 normalized (as TF-IDF rows are)"""
+        self.matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+        rng = np.random.default_rng(self.random_state)
+        n_features = self.matrix.shape[1]
+        width = min(self.hash_width, n_features)
+        # One (column, sign) per feature: a sparse n_features x width matrix instead of dense hyperplanes
+        self.feature_hasher = sparse.csr_matrix(
+            (rng.choice(np.float32([-1, 1]), n_features), (np.arange(n_features), rng.integers(0, width, n_features))),
+            shape=(n_features, width),
+        )
+        self.planes = rng.standard_normal((width, self.n_tables * self.n_bits)).astype(np.float32)
+
+        n_rows = self.matrix.shape[0]
+        codes = np.empty((n_rows, self.n_tables), dtype=np.int64)
+        # Project in chunks so the dense projection never holds every row at once
+        for start in range(0, n_rows, self.chunk_size):
+            end = min(start + self.chunk_size, n_rows)
+            codes[start:end] = self._codes(self._project(self.matrix[start:end]))
+
+        self.sorted_rows = np.empty((self.n_tables, n_rows), dtype=np.int32)
+        self.sorted_codes = np.empty((self.n_tables, n_rows), dtype=np.int64)
+        for table in range(self.n_tables):
+            order = np.argsort(codes[:, table], kind="stable")
+            self.sorted_rows[table] = order
+            self.sorted_codes[table] = codes[order, table]
+        return self
+
+    def _project(self, rows) -> np.ndarray:
+        projection = (rows @ self.feature_hasher) @ self.planes
+        return np.asarray(projection).reshape(rows.shape[0], self.n_tables, self.n_bits)
+
+    def _codes(self, projection: np.ndarray) -> np.ndarray:
+        return (projection > 0).astype(np.int64) @ self._bit_values
+
+    def candidates(self, vector) -> np.ndarray:
+        """Row ids sharing a probed bucket with `vector` in at least one table"""
+        projection = self._project(sparse.csr_matrix(vector, dtype=np.float32))[0]
+        codes = self._codes(projection[np.newaxis])[0]
+        # Flip the bits whose projections are closest to their hyperplane first
+        flip_order = np.argsort(np.abs(projection), axis=1)[:, :self.n_probes]
+
+        slices = []
+        for table in range(self.n_tables):
+            probes = [codes[table]] + [codes[table] ^ self._bit_values[bit] for bit in flip_order[table]]
+            table_codes = self.sorted_codes[table]
+            for code in probes:
+                left = np.searchsorted(table_codes, code, side="left")
+                right = np.searchsorted(table_codes, code, side="right")
+                if right > left:
+                    slices.append(self.sorted_rows[table, left:right])
+        if not slices:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(slices))
+
+    def query(self, vector, n: int, exclude=None, allowed=None):
+        """
+        Returns `(row_ids, scores)` of the approximate top `n` rows by cosine
+        similarity, restricted to rows where the boolean mask `allowed` is set
+        """
+        candidates = self.candidates(vector)
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        if allowed is not None:
+            candidates = candidates[allowed[candidates]]
+        if len(candidates) == 0:
+            return candidates, np.empty(0, dtype=np.float32)
+
+        scores = np.asarray((self.matrix[candidates] @ sparse.csr_matrix(vector, dtype=np.float32).T).todense()).ravel()
+        if len(candidates) > n:
+            top = np.argpartition(-scores, n - 1)[:n]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidates[top], scores[top]
+
+    def query_row(self, row: int, n: int, allowed=None):
+        """Approximate neighbours of an indexed row, excluding the row itself"""
+        return self.query(self.matrix[row], n, exclude=row, allowed=allowed)
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import pandas as pd
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of any saved artifact changes, so older files are never loaded
+ARTIFACT_FORMAT = 2
+
+# One worker: saves run in order, off the startup path, and finish before the interpreter exits
+_save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifact-save")
+
+
+class DataFingerprint:
+    """
+    Identifies the data and configuration a model was fitted on: row count,
+    maximum ids and a hash of the content. Frames can be added chunk by chunk,
+    so streamed data is fingerprinted without holding it in memory.
+    """
+
+    def __init__(self, id_columns: Iterable[str] = (), config: Optional[dict] = None):
+        self.id_columns = tuple(id_columns)
+        self.config = config or {}
+        self.rows = 0
+        self.max_ids = {column: None for column in self.id_columns}
+        self._hash = hashlib.sha256()
+
+    def update(self, frame: pd.DataFrame):
+        self.rows += len(frame)
+        if frame.empty:
+            return self
+        for column in self.id_columns:
+            if column in frame.columns:
+                chunk_max = int(frame[column].max())
+                current = self.max_ids[column]
+                self.max_ids[column] = chunk_max if current is None else max(current, chunk_max)
+        # Column order of MongoDB documents is not guaranteed; lists and dicts are hashed by their repr
+        columns = sorted(frame.columns)
+        self._hash.update(",".join(columns).encode())
+        hashed = pd.util.hash_pandas_object(frame[columns].astype(str), index=False)
+        self._hash.update(hashed.to_numpy().tobytes())
+        return self
+
+    def summary(self) -> dict:
+        return {
+            "format": ARTIFACT_FORMAT,
+            "rows": self.rows,
+            "maxIds": self.max_ids,
+            "content": self._hash.hexdigest(),
+            "config": self.config,
+        }
+
+    def digest(self) -> str:
+        """Short stable key of the summary, used in artifact file names"""
+        encoded = json.dumps(self.summary(), sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def fingerprint(frame: pd.DataFrame, id_columns: Iterable[str] = (), config: Optional[dict] = None) -> DataFingerprint:
+    return DataFingerprint(id_columns, config).update(frame)
+
+
+def artifact_path(base_path: Path, data_fingerprint: DataFingerprint) -> Path:
+    """`model.npz` -> `model.<fingerprint>.npz`: a stale artifact simply does not exist under the current name"""
+    return base_path.with_name(f"{base_path.stem}.{data_fingerprint.digest()}{base_path.suffix}")
+
+
+def save_atomic(path: Path, write: Callable[[Path], None]):
+    """
+    Writes through `write(tmp_path)` into a temporary file next to `path` and
+    renames it into place, so readers never see a partial artifact. Older
+    versions of the same artifact are removed afterwards.
+    """
+    tmp_path = path.with_name(f"{path.stem}.tmp-{os.getpid()}{path.suffix}")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    base_stem = path.stem.rsplit(".", 1)[0]
+    for old_path in path.parent.glob(f"{base_stem}.*{path.suffix}"):
+        if old_path != path and not old_path.name.startswith(f"{base_stem}.tmp-"):
+            old_path.unlink(missing_ok=True)
+
+
+def save_in_background(path: Path, write: Callable[[Path], None]) -> Future:
+    """Schedules `save_atomic` on the artifact worker thread; failures are logged, not raised"""
+    def log_result(future: Future):
+        if future.exception() is not None:
+            logger.error(f" Failed to save artifact {path.name}: {future.exception()}")
+        else:
+            logger.info(f"   Saved artifact {path.name}")
+
+    future = _save_executor.submit(save_atomic, path, write)
+    future.add_done_callback(log_result)
+    return future
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+# Number of set bits in every possible byte
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def normalize_category(category: str) -> str:
+    return " ".join(category.split()).lower()
+
+
+class CategoryIndex:
+    """
+    Inverted index from category to the catalog rows carrying it.
+
+    Each category owns a packed bitmap (one bit per catalog row, 8 rows per
+    byte), so multi-category filters are a single bitwise AND/OR reduction and
+    facet counts are a popcount over the AND with the current selection.
+    """
+
+    def __init__(self, categories: pd.Series):
+        """`categories` holds one list of category strings per catalog row, in row order"""
+        self.n_rows = len(categories)
+        exploded = categories.reset_index(drop=True).explode().dropna()
+        exploded = exploded[exploded.map(lambda value: isinstance(value, str))]
+        normalized = exploded.map(normalize_category)
+        keep = normalized != ""
+        exploded, normalized = exploded[keep], normalized[keep]
+
+        codes, self.categories = pd.factorize(normalized)
+        # Display label of each category: its first spelling in the catalog
+        self.labels = [" ".join(label.split()) for label in exploded.groupby(codes).first()]
+        self._index = {category: code for code, category in enumerate(self.categories)}
+
+        masks = np.zeros((len(self.categories), self.n_rows), dtype=bool)
+        masks[codes, exploded.index.to_numpy()] = True
+        self.bitmaps = np.packbits(masks, axis=1)
+
+    def bitmap(self, categories, mode: str = "any"):
+        """Packed bitmap of the rows having any (OR) or all (AND) of `categories`"""
+        codes = [self._index.get(normalize_category(category)) for category in categories]
+        if mode == "all":
+            if not codes or None in codes:
+                return np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+            return np.bitwise_and.reduce(self.bitmaps[codes], axis=0)
+        codes = [code for code in codes if code is not None]
+        if not codes:
+            return np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+        return np.bitwise_or.reduce(self.bitmaps[codes], axis=0)
+
+    def mask(self, categories, mode: str = "any") -> np.ndarray:
+        """Boolean mask over catalog rows, see `bitmap`"""
+        return np.unpackbits(self.bitmap(categories, mode), count=self.n_rows).astype(bool)
+
+    def facet_counts(self, rows_mask: np.ndarray = None) -> dict:
+        """Number of rows per category label, within `rows_mask` when given, most common first"""
+        bitmaps = self.bitmaps
+        if rows_mask is not None:
+            bitmaps = bitmaps & np.packbits(rows_mask)
+        counts = _POPCOUNT[bitmaps].sum(axis=1, dtype=np.int64)
+        order = np.argsort(-counts, kind="stable")
+        return {self.labels[code]: int(counts[code]) for code in order if counts[code] > 0}
@@ -1,26 +1,34 @@
 from fastapi import HTTPException
-import joblib
+import os
 import pandas as pd
 import numpy as np
-from surprise import Reader, Dataset, KNNBasic
 from pathlib import Path
 import logging
 
+from algorithms.artifacts import artifact_path, fingerprint, save_in_background
+from algorithms.item_knn import ItemKNN
 from db import RecommenderCommands, LocationCommands
+from monitoring import STAGE_LATENCY
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class CollaborativeFilter:
-    def __init__(self):
+    def __init__(self, content=None):
         self.recommender_db = RecommenderCommands()
         self.locations_db = LocationCommands()
-        self.MODEL_PATH = Path(__file__).parent / "collaborative_filter_model.pkl"
-        self.reader = Reader(rating_scale=(1, 5))
-        self.sim_options = {'name': 'cosine', 'user_based': False}  # Item-based CF
-        self.algo = KNNBasic(sim_options=self.sim_options)
+        self.MODEL_PATH = Path(__file__).parent / "collaborative_filter_model.npz"
+        # Item-based CF, cosine similarity over the ratings matrix
+        self.model = ItemKNN(
+            k=int(os.getenv("CF_NEIGHBORS", 100)),
+            shrinkage=float(os.getenv("CF_SHRINKAGE", 0)),
+            n_jobs=int(os.getenv("CF_FIT_JOBS", 0)) or None,
+            memory_budget_mb=int(os.getenv("CF_FIT_MEMORY_MB", 1024)),
+        )
         self.ratings = pd.DataFrame()
         self.tourism_data = pd.DataFrame()
+        # ContentBasedFilter whose TF-IDF index ranks keyword searches
+        self.content = content
     
     # main.py calls this 
     async def initialize_data_and_model(self):
@@ -86,30 +94,10 @@ class CollaborativeFilter:
         ]
 
     def filter_by_keyword(self, recommendations, keyword):
-        # Updated to handle category as a list
-        keyword_lower = keyword.lower()
-        
-        # Filter for name and description (still strings)
-        name_description_mask = (
-            recommendations['name'].str.contains(keyword, case=False, na=False) |
-            recommendations['description'].str.contains(keyword, case=False, na=False)
-        )
-        
-        # Filter for category (now a list)
-        # Create a mask for items where any category element contains the keyword
-        def check_categories(cats):
-            if not isinstance(cats, list):
-                return False
-            if len(cats) == 0:
-                return False
-            # Explicitly handle each category as a string
-            return any(isinstance(cat, str) and keyword_lower in cat.lower() for cat in cats)
-        
-        # Use the safer category checking function
-        category_mask = recommendations['category'].apply(check_categories)
-        
-        # Combine masks - ensure we're dealing with boolean Series
-        return recommendations[name_description_mask | category_mask]
+        """Rows of `recommendations` relevant to `keyword`, ranked by the content-based TF-IDF"""
+        if self.content is None:
+            raise HTTPException(status_code=500, detail="Keyword search is not available without the content-based filter")
+        return self.content.filter_by_keyword(recommendations, keyword)
 
     def is_country(self, user_input):
         return self.tourism_data['country'].str.contains(user_input, case=False, na=False).any() 
@@ -117,8 +105,11 @@ class CollaborativeFilter:
     def is_location_name(self, user_input):
         return self.tourism_data['name'].str.lower().eq(user_input.lower()).any()
 
-    async def get_collaborative_recommendations(self, user_id, user_input, n):
+    async def get_collaborative_recommendations(self, user_id, user_input, n, allowed_ids=None):
+        """`allowed_ids` optionally restricts the results to these locationIds"""
         try:
+            # With a restriction, look through the whole stored neighbourhood so n can still be filled
+            n_neighbors = n if allowed_ids is None else max(n, self.model.k)
             if user_input and self.is_location_name(user_input):
                 # If the user searches for an item, use item-based collaborative filtering
                 item_id = self.tourism_data.loc[self.tourism_data['name'].str.lower() == user_input.lower(), 'locationId'].values
@@ -126,7 +117,9 @@ class CollaborativeFilter:
                     logger.warning(f"No item found with name '{user_input}'.")
                     return []  # Return an empty list if no item is found
                 item_id = item_id[0]  # Get the first matching item ID
-                item_recommendations = self.get_item_recommendations(item_id, n)  # Returns a list of item IDs
+                item_recommendations = self.get_item_recommendations(item_id, n_neighbors)  # Returns a list of item IDs
+                if allowed_ids is not None:
+                    item_recommendations = [item for item in item_recommendations if item in allowed_ids]
                 recommendations = self.tourism_data[self.tourism_data['locationId'].isin(item_recommendations)][['name', 'category', 'country', 'city', 'description', 'rating']]
             else:
                 # If the user does not search for an item, recommend top-rated items based on their rating history
@@ -134,12 +127,15 @@ class CollaborativeFilter:
                 
                 # Get recommendations for each item rated by the user
                 all_recommendations = []
-                for item_id in user_items:
-                    item_recommendations = self.get_item_recommendations(item_id, n)  # Returns a list of item IDs
-                    all_recommendations.extend(item_recommendations)
+                with STAGE_LATENCY.time("cf_neighbors"):
+                    for item_id in user_items:
+                        item_recommendations = self.get_item_recommendations(item_id, n_neighbors)  # Returns a list of item IDs
+                        all_recommendations.extend(item_recommendations)
                 
                 # Remove duplicates and items already rated by the user
                 unique_recommendations = list(set(all_recommendations) - set(user_items))
+                if allowed_ids is not None:
+                    unique_recommendations = [item for item in unique_recommendations if item in allowed_ids]
                 
                 # Get details for the recommended items
                 recommendations = self.tourism_data[self.tourism_data['locationId'].isin(unique_recommendations)][['name', 'category', 'city', 'country', 'description']]
@@ -172,44 +168,46 @@ class CollaborativeFilter:
         try:
             logger.info(f"  Generating recommendations for item {item_id}...")
             
-            # Convert the item ID to the inner ID used by the model
-            inner_id = self.algo.trainset.to_inner_iid(item_id)
-            
-            # Get the nearest neighbors
-            neighbors = self.algo.get_neighbors(inner_id, k=n)
+            if not self.model.has_item(item_id):
+                logger.warning(f"   Item {item_id} is not in the trained model.")
+                return []
             
-            # Convert inner IDs back to raw item IDs
-            item_recommendations = [self.algo.trainset.to_raw_iid(inner_id) for inner_id in neighbors]
-
-            return item_recommendations  # Return a list of item IDs
+            # Nearest neighbors as raw item IDs, most similar first
+            return self.model.get_neighbors(item_id, n)
         except Exception as e:
             logger.error(f" Failed to generate recommendations: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to generate recommendations: {e}")
 
-    def train_and_save_model(self):
+    def model_path(self):
+        """Artifact path keyed by the current ratings and neighbor settings"""
+        return artifact_path(self.MODEL_PATH, fingerprint(
+            self.ratings[['userId', 'locationId', 'rating']], ['userId', 'locationId'],
+            {"k": self.model.k, "shrinkage": self.model.shrinkage},
+        ))
+
+    def train_and_save_model(self, model_path=None):
         try:
             logger.info("   Training the collaborative filtering model...")
             
             # Train the model
-            data = Dataset.load_from_df(self.ratings[['userId', 'locationId', 'rating']].copy(), self.reader)
-            trainset = data.build_full_trainset()
-            self.algo.fit(trainset)
+            self.model.fit(self.ratings[['userId', 'locationId', 'rating']])
             
-            # Save the model
-            joblib.dump(self.algo, self.MODEL_PATH)
-            logger.info("   CF Model trained and saved successfully.")
+            # Save the model off the startup path
+            save_in_background(model_path or self.model_path(), self.model.save)
+            logger.info("   CF Model trained successfully.")
         except Exception as e:
             logger.error(f" Failed to train and save model: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to train the model: {e}")
 
     def load_model(self):
         try:
-            if self.MODEL_PATH.exists():
-                logger.info("   Loading pre-trained model...")
-                self.algo = joblib.load(self.MODEL_PATH)
+            model_path = self.model_path()
+            if model_path.exists():
+                logger.info(f"   Loading pre-trained model {model_path.name}...")
+                self.model = ItemKNN.load(model_path)
             else:
-                logger.info("   No pre-trained model found. Training a new model...")
-                self.train_and_save_model()
+                logger.info("   No pre-trained model for the current ratings. Training a new model...")
+                self.train_and_save_model(model_path)
         except Exception as e:
             logger.error(f" Failed to load model: {e}")
             raise HTTPException(status_code=500, detail=f"  Failed to load the model: {e}")
\ No newline at end of file
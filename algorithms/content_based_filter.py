@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import numpy as np
 import logging
@@ -8,7 +9,10 @@ from fastapi import HTTPException
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 
+from algorithms.ann_index import RandomProjectionLSH
+from algorithms.artifacts import artifact_path, fingerprint, save_in_background
 from db import LocationCommands
+from monitoring import STAGE_LATENCY
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,16 +24,36 @@ class ContentBasedFilter:
         self.tourism_data = pd.DataFrame()
         self.tfidf = None
         self.tfidf_matrix = None
+        self.term_postings = None
         self.keywords_list = None
+        self.location_keywords = None
         self.cosine_sim = None
         self.indices = None
         
+        # "exact" keeps the full N x N cosine matrix, "ann" a near-linear LSH index for large catalogs
+        self.similarity_mode = os.getenv("CB_SIMILARITY_MODE", "exact")
+        self.ann_params = {
+            "n_tables": int(os.getenv("CB_ANN_TABLES", 16)),
+            "n_bits": int(os.getenv("CB_ANN_BITS", 10)),
+            "n_probes": int(os.getenv("CB_ANN_PROBES", 2)),
+            "hash_width": int(os.getenv("CB_ANN_HASH_WIDTH", 1024)),
+        }
+        self.ann_index = None
+        
     async def initialize_data_and_model(self):
-        await self.initialize()
+        """Loads the saved model when it was built from the current locations and settings, otherwise fits and saves one"""
+        tourism_data = await self.load_tourism_data()
+        model_path = artifact_path(self.MODEL_PATH, fingerprint(
+            tourism_data, ["locationId"], {"similarity_mode": self.similarity_mode, "ann": self.ann_params},
+        ))
         try:
-            self.load_model()
-        except:
-            self.train_and_save_model()
+            self.load_model(model_path)
+            logger.info(f"   Loaded content-based model {model_path.name}")
+            return
+        except FileNotFoundError:
+            logger.info("   No content-based model for the current data. Fitting a new one...")
+        self.fit(tourism_data)
+        self.train_and_save_model(model_path)
             
     # Load the tourism dataset from MongoDB
     async def load_tourism_data(self):
@@ -68,11 +92,17 @@ class ContentBasedFilter:
             logger.error(f" Failed to load tourism data from database: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to load tourism data: {e}")
 
-    # Function to extract keywords from description
-    def extract_keywords(self, text):
-        if self.keywords_list is None:
-            raise HTTPException(status_code=500, detail="Keywords list not initialized")
-        return ', '.join([word for word in text.split() if word in self.keywords_list])
+    def top_keywords(self, k=10):
+        """The k highest-weighted TF-IDF terms of every location, as comma-separated strings in row order"""
+        matrix = self.tfidf_matrix.tocsr()
+        row_lengths = np.diff(matrix.indptr)
+        rows = np.repeat(np.arange(matrix.shape[0]), row_lengths)
+        # Sort by row, then by descending weight (ties alphabetical), and keep the first k entries of each row
+        order = np.lexsort((matrix.indices, -matrix.data, rows))
+        rank = np.arange(len(order)) - matrix.indptr[rows[order]]
+        terms = self.keywords_list[matrix.indices[order[rank < k]]]
+        splits = np.cumsum(np.minimum(row_lengths, k))[:-1]
+        return pd.Series([', '.join(row_terms) for row_terms in np.split(terms, splits)])
 
     # Helper function to convert category list to string
     def categories_to_string(self, categories):
@@ -90,9 +120,13 @@ class ContentBasedFilter:
 
     async def initialize(self):
         """Initialize fresh model with database data"""
+        # Load from MongoDB instead of CSV
+        self.fit(await self.load_tourism_data())
+
+    def fit(self, tourism_data):
+        """Fits the TF-IDF model and similarity index on the given locations"""
         try:
-            # Load from MongoDB instead of CSV
-            self.tourism_data = await self.load_tourism_data()
+            self.tourism_data = tourism_data
             
             self.tourism_data = self.tourism_data.apply(
                 lambda col: col.fillna('') if col.dtype == 'object' else col.fillna(0)
@@ -117,8 +151,16 @@ class ContentBasedFilter:
             
             self.tfidf_matrix = self.tfidf.fit_transform(self.tourism_data['metadata'])
             self.keywords_list = self.tfidf.get_feature_names_out()
+            self.location_keywords = self.top_keywords()
+            # Column-major copy so a query only touches the postings of its own terms
+            self.term_postings = self.tfidf_matrix.tocsc()
             
-            self.cosine_sim = cosine_similarity(self.tfidf_matrix, self.tfidf_matrix)
+            if self.similarity_mode == "ann":
+                self.ann_index = RandomProjectionLSH(**self.ann_params).fit(self.tfidf_matrix)
+                self.cosine_sim = None
+            else:
+                self.cosine_sim = cosine_similarity(self.tfidf_matrix, self.tfidf_matrix)
+                self.ann_index = None
             self.tourism_data = self.tourism_data.reset_index()
             self.indices = pd.Series(self.tourism_data.index, index=self.tourism_data['name'])
             
@@ -135,33 +177,106 @@ class ContentBasedFilter:
             recommendations['city'].str.contains(location, case=False, na=False)
         ]
 
+    def search(self, query, n=None):
+        """
+        Row positions of the locations matching a free-text query, most relevant
+        first, with their scores. Scores are accumulated over the postings of the
+        query's terms only; a word outside the vocabulary counts as the prefix
+        of the terms it starts (e.g. "mus" -> "museum", "music"). When no term
+        matches (e.g. only stop words) the query is matched as a substring of
+        name, categories and description, as keyword filters always were.
+        """
+        if self.tfidf is None or self.term_postings is None:
+            raise HTTPException(status_code=500, detail="Content-based filtering module not initialized")
+        rows, scores = self._posting_scores(self._term_weights(query))
+        if len(rows) == 0:
+            rows = self._substring_rows(query)
+            return rows, np.ones(len(rows), dtype=np.float32)
+        
+        if n is not None and len(rows) > n:
+            top = np.argpartition(-scores, n - 1)[:n]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return rows[order], scores[order]
+
+    def _term_weights(self, query):
+        """Vocabulary column -> IDF weight of every term the query contains or, for partial words, starts"""
+        tokens = self.tfidf.build_tokenizer()(self.tfidf.build_preprocessor()(query))
+        stop_words = self.tfidf.get_stop_words() or ()
+        weights = {}
+        for token in tokens:
+            column = self.tfidf.vocabulary_.get(token)
+            if column is not None:
+                columns = [column]
+            elif token in stop_words:
+                continue
+            else:
+                # keywords_list is the sorted vocabulary, so the terms a token starts are contiguous
+                start = np.searchsorted(self.keywords_list, token)
+                columns = range(start, np.searchsorted(self.keywords_list, token + "\uffff"))
+            for column in columns:
+                weights[column] = weights.get(column, 0.0) + self.tfidf.idf_[column]
+        return weights
+
+    def _posting_scores(self, weights):
+        """(rows, scores) summed over the postings of the weighted term columns"""
+        if not weights:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        postings = self.term_postings
+        rows, values = [], []
+        for column, weight in weights.items():
+            start, end = postings.indptr[column], postings.indptr[column + 1]
+            rows.append(postings.indices[start:end])
+            values.append(postings.data[start:end] * weight)
+        rows, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        return rows.astype(np.int64), np.bincount(inverse, weights=np.concatenate(values)).astype(np.float32)
+
+    def _substring_rows(self, query):
+        """Rows whose name, categories or description contain `query`, in catalog order"""
+        query = query.strip()
+        if not query:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.tourism_data['metadata'].str.contains(query, case=False, regex=False, na=False).to_numpy())
+
     def filter_by_keyword(self, recommendations, keyword):
+        """Rows of `recommendations` relevant to `keyword`, most relevant first"""
         if self.tourism_data is None:
             raise HTTPException(status_code=500, detail="Tourism data not loaded")
+        rows, _ = self.search(keyword)
+        rank = pd.Series(np.arange(len(rows)), index=self.tourism_data['locationId'].to_numpy()[rows])
+        rank = rank[~rank.index.duplicated()]
+        positions = rank.reindex(recommendations['locationId']).to_numpy()
+        matched = np.flatnonzero(~np.isnan(positions))
+        return recommendations.iloc[matched[np.argsort(positions[matched], kind="stable")]]
+
+    def similar_items(self, index, n, allowed=None):
+        """
+        Row positions of the n locations most similar to row `index`, most similar
+        first, restricted to rows where the boolean mask `allowed` is set
+        """
+        if self.ann_index is not None:
+            rows, _ = self.ann_index.query_row(index, n, allowed)
+            return rows.tolist()
         
-        keyword_lower = keyword.lower()
-        
-        # Filter for name and description (still strings)
-        name_description_mask = (
-            recommendations['name'].str.contains(keyword, case=False, na=False) |
-            recommendations['description'].str.contains(keyword, case=False, na=False)
-        )
-        
-        # Filter for category (now a list)
-        # Create a mask for items where any category element contains the keyword
-        def check_categories(cats):
-            if not isinstance(cats, list):
-                return False
-            if len(cats) == 0:
-                return False
-            # Explicitly handle each category as a string
-            return any(isinstance(cat, str) and keyword_lower in cat.lower() for cat in cats)
-        
-        # Use the safer category checking function
-        category_mask = recommendations['category'].apply(check_categories)
-        
-        # Combine masks - ensure we're dealing with boolean Series
-        return recommendations[name_description_mask | category_mask]
+        scores = self.cosine_sim[index].copy()
+        scores[index] = -np.inf  # Exclude the input item itself
+        if allowed is not None:
+            scores[~allowed] = -np.inf
+        n = min(n, int(np.isfinite(scores).sum()))
+        if n <= 0:
+            return []
+        top = np.argpartition(-scores, n - 1)[:n]
+        return top[np.argsort(-scores[top], kind="stable")].tolist()
+
+    def profile_scores(self, rows, weights):
+        """
+        Cosine-style affinity of every location to a user profile built as the
+        `weights`-weighted sum of the TF-IDF rows at `rows` (row positions).
+        """
+        if self.tfidf_matrix is None or len(rows) == 0:
+            return None
+        profile = self.tfidf_matrix[rows].T @ np.asarray(weights, dtype=np.float64)
+        return np.asarray(self.tfidf_matrix @ profile, dtype=np.float32).ravel()
 
     def is_location(self, user_input):
         if self.tourism_data is None:
@@ -174,10 +289,16 @@ class ContentBasedFilter:
         return self.tourism_data['name'].str.lower().eq(user_input.lower()).any()
 
     # Recommendation function
-    async def get_content_recommendations(self, user_input, n):
+    async def get_content_recommendations(self, user_input, n, allowed_ids=None):
+        """`allowed_ids` optionally restricts the results to these locationIds"""
+        return self.content_recommendations(user_input, n, allowed_ids)
+
+    def content_recommendations(self, user_input, n, allowed_ids=None):
+        """Synchronous body of get_content_recommendations, safe to run in a worker thread"""
         try:
-            if self.tourism_data is None or self.cosine_sim is None or self.indices is None:
+            if self.tourism_data is None or (self.cosine_sim is None and self.ann_index is None) or self.indices is None:
                 raise HTTPException(status_code=500, detail="Content-based filtering module not initialized")
+            allowed = None if allowed_ids is None else self.tourism_data['locationId'].isin(allowed_ids).to_numpy()
 
             if user_input and self.is_location_name(user_input):
                 # If the input is an exact location name (e.g., "Louvre Museum"), recommend similar items
@@ -185,29 +306,29 @@ class ContentBasedFilter:
                     logger.warning(f"   No recommendations found for {user_input}.")
                     return []  # Return an empty list if no recommendations are found
 
-                index = self.indices[user_input]
-                sim_scores = list(enumerate(self.cosine_sim[index]))
-                sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)[1:n+1]  # Exclude the input item itself
-                place_indices = [i[0] for i in sim_scores]
-                
-                recommendations = self.tourism_data.iloc[place_indices][['name', 'category', 'country', 'city', 'rating', 'description']]
-                recommendations['keywords'] = recommendations['description'].apply(self.extract_keywords)
+                with STAGE_LATENCY.time("cb_similarity"):
+                    index = self.indices[user_input]
+                    place_indices = self.similar_items(index, n, allowed)
+                    
+                    recommendations = self.tourism_data.iloc[place_indices][['name', 'category', 'country', 'city', 'rating', 'description']]
+                    recommendations['keywords'] = self.location_keywords.iloc[place_indices].to_numpy()
             else:
-                # If the input is not an exact location name, treat it as a keyword
-                recommendations = self.tourism_data.copy()
-
-                # Apply location-based filtering if the input is a location
-                if user_input and self.is_location(user_input):
-                    recommendations = self.filter_by_location(recommendations, user_input)
-
-                # Apply keyword-based filtering if the input is not a location or location name
-                if user_input and not self.is_location(user_input) and not self.is_location_name(user_input):
-                    keyword_filtered = self.filter_by_keyword(recommendations, user_input)
-                    if not keyword_filtered.empty:  # Check if keyword filtering returned any results
-                        recommendations = keyword_filtered
-                    else:
-                        logger.info(f"  No results found for keyword '{user_input}'. Returning top-rated items.")
-                        recommendations = recommendations.head(n)  # Fallback to top-rated items
+                with STAGE_LATENCY.time("cb_filtering"):
+                    # If the input is not an exact location name, treat it as a keyword
+                    recommendations = self.tourism_data.copy() if allowed is None else self.tourism_data[allowed]
+
+                    # Apply location-based filtering if the input is a location
+                    if user_input and self.is_location(user_input):
+                        recommendations = self.filter_by_location(recommendations, user_input)
+
+                    # Apply keyword-based filtering if the input is not a location or location name
+                    if user_input and not self.is_location(user_input) and not self.is_location_name(user_input):
+                        keyword_filtered = self.filter_by_keyword(recommendations, user_input)
+                        if not keyword_filtered.empty:  # Check if keyword filtering returned any results
+                            recommendations = keyword_filtered
+                        else:
+                            logger.info(f"  No results found for keyword '{user_input}'. Returning top-rated items.")
+                            recommendations = recommendations.head(n)  # Fallback to top-rated items
 
             # Return the top n recommendations
             return recommendations.head(n).to_dict(orient="records")
@@ -215,23 +336,32 @@ class ContentBasedFilter:
             logger.error(f" Failed to generate content-based recommendations: {e}, {traceback.print_exc()}")
             return []  # Return an empty list if an error occurs
 
-    def train_and_save_model(self):
+    def train_and_save_model(self, model_path=None):
+        """Saves the fitted model in the background; `model_path` defaults to MODEL_PATH"""
         model_data = {
             "tourism_data": self.tourism_data,
             "cosine_sim": self.cosine_sim,
+            "ann_index": self.ann_index,
             "indices": self.indices,
             "tfidf": self.tfidf,
-            "keywords_list": self.keywords_list
+            "tfidf_matrix": self.tfidf_matrix,
+            "keywords_list": self.keywords_list,
+            "location_keywords": self.location_keywords
         }
-        joblib.dump(model_data, self.MODEL_PATH)
+        return save_in_background(model_path or self.MODEL_PATH, lambda path: joblib.dump(model_data, path))
 
-    def load_model(self):
-        if not self.MODEL_PATH.exists():
+    def load_model(self, model_path=None):
+        model_path = model_path or self.MODEL_PATH
+        if not model_path.exists():
             raise FileNotFoundError("No saved model found")
             
-        model_data = joblib.load(self.MODEL_PATH)
+        model_data = joblib.load(model_path)
         self.tourism_data = model_data["tourism_data"]
         self.cosine_sim = model_data["cosine_sim"] 
+        self.ann_index = model_data.get("ann_index")
         self.indices = model_data["indices"]
         self.tfidf = model_data["tfidf"]
-        self.keywords_list = model_data["keywords_list"]
\ No newline at end of file
+        self.tfidf_matrix = model_data["tfidf_matrix"]
+        self.term_postings = self.tfidf_matrix.tocsc()
+        self.keywords_list = model_data["keywords_list"]
+        self.location_keywords = model_data.get("location_keywords", self.location_keywords)
\ No newline at end of file
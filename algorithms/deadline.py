@@ -0,0 +1,114 @@
+import asyncio
+import math
+import os
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from monitoring import metrics
+
+load_dotenv()
+
+DEGRADED = metrics.counter(
+    "recommendation_degraded_total",
+    "Recommendations served from a precomputed tier because the latency budget ran out, by tier and skipped stage",
+    ("tier", "stage"),
+)
+
+# Part of every budget kept back for serving a precomputed fallback and encoding the response
+DEADLINE_RESERVE_MS = float(os.getenv("DEADLINE_RESERVE_MS", 5))
+
+
+class BudgetExhausted(Exception):
+    """A stage of the pipeline would not finish within the request's latency budget"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Latency budget exhausted before stage '{stage}'")
+        self.stage = stage
+
+
+class StageEstimator:
+    """
+    Running latency estimate of each pipeline stage, computed the way TCP
+    estimates its retransmission timeout: smoothed mean plus four smoothed mean
+    deviations, so a stage is only started when it will very likely finish.
+    """
+
+    def __init__(self, alpha: float = 0.125, beta: float = 0.25):
+        self.alpha = alpha
+        self.beta = beta
+        self.mean: Dict[str, float] = {}
+        self.deviation: Dict[str, float] = {}
+
+    def observe(self, stage: str, seconds: float):
+        mean = self.mean.get(stage)
+        if mean is None:
+            self.mean[stage] = seconds
+            self.deviation[stage] = seconds / 2
+            return
+        self.deviation[stage] = (1 - self.beta) * self.deviation[stage] + self.beta * abs(seconds - mean)
+        self.mean[stage] = (1 - self.alpha) * mean + self.alpha * seconds
+
+    def estimate(self, stage: str) -> float:
+        """Seconds the stage should be given; 0 until it ran once, so it gets measured"""
+        if stage not in self.mean:
+            return 0.0
+        return self.mean[stage] + 4 * self.deviation[stage]
+
+
+class Deadline:
+    """
+    Latency budget of one request. Stages are measured whether or not a budget
+    is set, so the estimates are already warm when budgeted requests arrive.
+    """
+
+    def __init__(self, budget_ms: Optional[float], estimates: StageEstimator, reserve_ms: float = DEADLINE_RESERVE_MS):
+        self.estimates = estimates
+        self.bounded = budget_ms is not None
+        self.expires = time.perf_counter() + (budget_ms - reserve_ms) / 1000 if self.bounded else math.inf
+
+    def remaining(self) -> float:
+        """Seconds left for optional work, the fallback reserve excluded"""
+        return self.expires - time.perf_counter()
+
+    def require(self, stage: str):
+        """Raises BudgetExhausted if `stage` is not expected to finish in the remaining budget"""
+        if self.bounded and self.remaining() <= self.estimates.estimate(stage):
+            raise BudgetExhausted(stage)
+
+    @contextmanager
+    def measure(self, stage: str):
+        started = time.perf_counter()
+        yield
+        self.estimates.observe(stage, time.perf_counter() - started)
+
+    async def run(self, stage: str, awaitable: Awaitable):
+        """Awaits `stage` if it is expected to fit in the remaining budget, see bound"""
+        try:
+            self.require(stage)
+        except BudgetExhausted:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise
+        return await self.bound(stage, awaitable)
+
+    async def bound(self, stage: str, awaitable: Awaitable):
+        """
+        Awaits `awaitable` as `stage` for at most the remaining budget. When it
+        runs out the work is cancelled, so a request that was already answered
+        from a fallback tier does not keep using capacity; the time it ran still
+        updates the estimate, as a lower bound of the stage's duration.
+        """
+        started = time.perf_counter()
+        if not self.bounded:
+            result = await awaitable
+        else:
+            try:
+                result = await asyncio.wait_for(awaitable, timeout=max(self.remaining(), 0))
+            except asyncio.TimeoutError:
+                self.estimates.observe(stage, time.perf_counter() - started)
+                raise BudgetExhausted(stage)
+        self.estimates.observe(stage, time.perf_counter() - started)
+        return result
@@ -0,0 +1,59 @@
+import json
+import os
+from typing import Dict, Optional
+
+import numpy as np
+
+# Weight of each engine's normalized scores, per user segment:
+#   cold_start: no ratings yet, light: 1-15 ratings, heavy: more than 15 ratings
+SEGMENT_WEIGHTS = {
+    "cold_start": {"cluster": 0.7, "popularity": 0.3},
+    "light": {"content": 0.5, "cf": 0.2, "popularity": 0.3},
+    "heavy": {"cf": 0.6, "content": 0.2, "popularity": 0.2},
+}
+# e.g. FUSION_WEIGHTS='{"heavy": {"cf": 0.8, "popularity": 0.2}}'
+SEGMENT_WEIGHTS.update(json.loads(os.getenv("FUSION_WEIGHTS") or "{}"))
+
+HEAVY_RATER_THRESHOLD = 15
+
+
+def user_segment(ratings_count: int) -> str:
+    if ratings_count == 0:
+        return "cold_start"
+    return "heavy" if ratings_count > HEAVY_RATER_THRESHOLD else "light"
+
+
+def fuse_scores(vectors: Dict[str, Optional[np.ndarray]], weights: Dict[str, float]) -> np.ndarray:
+    """
+    Weighted sum of min-max normalized score vectors over catalog positions.
+
+    NaN marks a location an engine did not score; it contributes 0 after
+    normalization. Engines missing from `vectors` (or None) are skipped.
+    """
+    names = [name for name in weights if vectors.get(name) is not None]
+    if not names:
+        raise ValueError(f"None of the weighted engines {list(weights)} produced scores")
+    stacked = np.vstack([vectors[name] for name in names]).astype(np.float32)
+    scored = ~np.isnan(stacked)
+    low = np.min(np.where(scored, stacked, np.inf), axis=1, keepdims=True)
+    high = np.max(np.where(scored, stacked, -np.inf), axis=1, keepdims=True)
+    span = np.where(high > low, high - low, 1.0)
+    normalized = np.where(scored, (stacked - low) / span, 0.0)
+    return np.asarray([weights[name] for name in names], dtype=np.float32) @ normalized
+
+
+def top_n(scores: np.ndarray, n: int, exclude: Optional[np.ndarray] = None, allowed: Optional[np.ndarray] = None) -> np.ndarray:
+    """Positions of the n highest scores, best first, skipping `exclude` and anything outside `allowed`"""
+    scores = scores.astype(np.float32, copy=True)
+    if allowed is not None:
+        mask = np.zeros(len(scores), dtype=bool)
+        mask[allowed] = True
+        scores[~mask] = -np.inf
+    if exclude is not None and len(exclude):
+        scores[exclude] = -np.inf
+
+    n = min(n, int(np.isfinite(scores).sum()))
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, n - 1)[:n]
+    return top[np.argsort(-scores[top], kind="stable")]
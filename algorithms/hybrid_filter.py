@@ -1,13 +1,27 @@
+import asyncio
+import os
 import logging
 import traceback
+from functools import partial
 import pandas as pd
 import numpy as np
+from pathlib import Path
 from fastapi import HTTPException
 
+from algorithms.admission import AdmissionController
+from algorithms.als import ALSRecommender
+from algorithms.artifacts import DataFingerprint, artifact_path, fingerprint, save_in_background
+from algorithms.category_index import CategoryIndex, normalize_category
 from algorithms.collaborative_filter import CollaborativeFilter
 from algorithms.content_based_filter import ContentBasedFilter
+from algorithms.deadline import DEGRADED, BudgetExhausted, Deadline, StageEstimator
+from algorithms.fusion import SEGMENT_WEIGHTS, fuse_scores, top_n, user_segment
 from algorithms.k_means_cluster import UserClusterer
-from db import UserCommands, RecommenderCommands, LocationCommands
+from algorithms.name_index import NameIndex
+from algorithms.single_flight import SingleFlight
+from db import UserCommands, RecommenderCommands, LocationCommands, TTLCache
+from models.recommendations import RecommendationsModel
+from monitoring import STAGE_LATENCY, BRANCH_COUNT
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,14 +35,49 @@ class HybridFilter:
         self.ratings = pd.DataFrame()
         self.tourism_data = pd.DataFrame()
         
+        self.location_rows = pd.Series(dtype=int)
+        self.category_index = None
+        self.name_index = None
+        self.user_history = {}
+        self.popularity_prior = np.empty(0, dtype=np.float32)
+        # RecommendationsModel JSON of each catalog row, see build_encoded_rows
+        self.encoded_rows = None
+        # Identifies the catalog and ratings the models were built from, used in HTTP ETags
+        self.data_version = None
+        
         self.clusterer = None
         self.cf = None
         self.cb = None
+        self.als = None
+        self.ALS_MODEL_PATH = Path(__file__).parent / "als_model.npz"
+        self.als_params = dict(
+            factors=int(os.getenv("ALS_FACTORS", 32)),
+            regularization=float(os.getenv("ALS_REGULARIZATION", 0.1)),
+            iterations=int(os.getenv("ALS_ITERATIONS", 15)),
+            implicit=os.getenv("ALS_IMPLICIT") == "1",
+            alpha=float(os.getenv("ALS_ALPHA", 10)),
+        )
+        # CF engine used when a request does not pick one: "knn" (item neighbors) or "als" (matrix factorization)
+        self.default_cf_engine = os.getenv("CF_ENGINE", "knn")
+        # userId -> profile, preferences and cluster; the user write routes invalidate entries
+        self.user_features = TTLCache(
+            int(os.getenv("USER_CACHE_SIZE", 50000)),
+            float(os.getenv("USER_CACHE_TTL_SECONDS", 300)),
+        )
+        # Identical concurrent requests share one computation
+        self.in_flight = SingleFlight("recommendations") if os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1" else None
+        # Per-branch concurrency limits with bounded queues, shedding overload with 503
+        self.admission = AdmissionController() if os.getenv("ADMISSION_ENABLED", "1") == "1" else None
+        # Latency of each pipeline stage, to skip the stages a request's budget cannot fit
+        self.stage_estimates = StageEstimator()
+        # Served when a budget runs out: userId -> cluster and cluster -> scores, see build_fallback_scores
+        self.cluster_memberships = {}
+        self.cluster_fallback_scores = {}
 
     async def initialize(self):
         self.clusterer = UserClusterer()
-        self.cf = CollaborativeFilter()
         self.cb = ContentBasedFilter()
+        self.cf = CollaborativeFilter(content=self.cb)
         
         # Initialize components
         await self.clusterer.initialize()
@@ -38,6 +87,10 @@ class HybridFilter:
         # Load data
         await self.fetch_and_process_ratings()
         await self.load_tourism_data()
+        self.load_or_train_als()
+        self.build_score_indexes()
+        await self.build_fallback_scores()
+        self.data_version = DataFingerprint(["locationId", "userId"]).update(self.tourism_data).update(self.ratings).digest()
         
         logger.info("   Hybrid filter initialized.")
         
@@ -45,6 +98,22 @@ class HybridFilter:
         ratings_from_mongodb = pd.DataFrame(await self.recommender_db.get_ratings())
         self.ratings = pd.DataFrame(ratings_from_mongodb)
     
+    def load_or_train_als(self):
+        self.als = ALSRecommender(**self.als_params)
+        if self.ratings.empty:
+            return
+        
+        ratings = self.ratings[['userId', 'locationId', 'rating']]
+        model_path = artifact_path(self.ALS_MODEL_PATH, fingerprint(ratings, ['userId', 'locationId'], self.als_params))
+        if model_path.exists():
+            logger.info(f"   Loading pre-trained ALS model {model_path.name}...")
+            self.als = ALSRecommender.load(model_path)
+            return
+        
+        logger.info("   No pre-trained ALS model for the current ratings. Training a new model...")
+        self.als.fit(ratings)
+        save_in_background(model_path, self.als.save)
+    
     async def load_tourism_data(self):
         """
         Load tourism data from MongoDB locations collection.
@@ -84,73 +153,342 @@ class HybridFilter:
                     else:
                         self.tourism_data[col] = self.tourism_data[col].fillna(0)
             
+            # Catalog row position of each locationId
+            self.location_rows = pd.Series(np.arange(len(self.tourism_data)), index=self.tourism_data['locationId'])
+            self.category_index = CategoryIndex(self.tourism_data['category'])
+            self.name_index = NameIndex(self.tourism_data['locationId'], self.tourism_data['name'])
+            
             logger.info("   Tourism data loaded successfully from database.")
         except Exception as e:
             logger.error(f" Failed to load tourism data from database: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to load tourism data: {e}")
 
-    async def get_recommendations(self, user_id, user_input=None, n=10):
+    def build_score_indexes(self):
+        """
+        Precompute the arrays the fusion stage scores with: every rating as
+        (user, catalog position, value), each user's history, a popularity prior
+        and the position of every catalog row inside each engine's item order.
+        """
+        ratings = self.ratings
+        if not ratings.empty:
+            ratings = ratings.drop_duplicates(subset=['userId', 'locationId'], keep='last')
+            positions = self.location_rows.reindex(ratings['locationId']).to_numpy()
+            ratings = ratings[~np.isnan(positions)]
+            positions = positions[~np.isnan(positions)]
+        else:
+            positions = np.empty(0)
+        self.rating_users = ratings['userId'].to_numpy() if not ratings.empty else np.empty(0)
+        self.rating_positions = positions.astype(np.int64)
+        self.rating_values = ratings['rating'].to_numpy(dtype=np.float32) if not ratings.empty else np.empty(0, dtype=np.float32)
+        
+        # userId -> (catalog positions, ratings) of everything the user rated
+        self.user_history = {}
+        if len(self.rating_users):
+            order = np.argsort(self.rating_users, kind='stable')
+            users, starts = np.unique(self.rating_users[order], return_index=True)
+            for user_id, rows in zip(users.tolist(), np.split(order, starts[1:])):
+                self.user_history[user_id] = (self.rating_positions[rows], self.rating_values[rows])
+        
+        # Bayesian average: items with few ratings are pulled towards the global mean
+        n_items = len(self.tourism_data)
+        counts = np.bincount(self.rating_positions, minlength=n_items)
+        sums = np.bincount(self.rating_positions, weights=self.rating_values, minlength=n_items)
+        global_mean = self.rating_values.mean() if len(self.rating_values) else 0.0
+        prior_weight = counts[counts > 0].mean() if (counts > 0).any() else 1.0
+        self.popularity_prior = ((sums + prior_weight * global_mean) / (counts + prior_weight)).astype(np.float32)
+        
+        self.cb_rows = self._rows_in(self.cb.tourism_data['locationId'])
+        self.knn_rows = self._rows_in(self.cf.model.item_ids)
+        self.als_rows = self._rows_in(self.als.item_ids)
+
+    async def build_fallback_scores(self):
+        """Score vector of each cluster, its peers' ratings fused with popularity, for the "cluster" tier"""
+        self.cluster_memberships = await self.user_db.get_cluster_memberships()
+        peers = {}
+        for user_id, cluster in self.cluster_memberships.items():
+            peers.setdefault(cluster, []).append(user_id)
+        weights = SEGMENT_WEIGHTS["cold_start"]
+        self.cluster_fallback_scores = {
+            cluster: fuse_scores({"cluster": self.peer_scores(peer_ids), "popularity": self.popularity_prior}, weights)
+            for cluster, peer_ids in peers.items()
+        }
+
+    def _rows_in(self, location_ids):
+        """Position of each catalog row inside `location_ids`, -1 where absent"""
+        order = pd.Series(np.arange(len(location_ids)), index=pd.Index(location_ids))
+        order = order[~order.index.duplicated()]
+        return order.reindex(self.tourism_data['locationId']).fillna(-1).to_numpy(dtype=np.int64)
+
+    def _on_catalog(self, scores, rows):
+        """Reorder an engine's score vector into catalog order, NaN for locations the engine does not know"""
+        if scores is None:
+            return None
+        known = rows >= 0
+        catalog_scores = np.full(len(rows), np.nan, dtype=np.float32)
+        catalog_scores[known] = scores[rows[known]]
+        return catalog_scores
+
+    async def get_recommendations(self, user_id, user_input=None, n=10, engine=None, categories=None, category_mode="any", as_positions=False, budget_ms=None):
+        """
+        `categories` keeps only locations having any (`category_mode="any"`) or all (`"all"`) of them.
+        With `as_positions`, branches that rank the catalog return row positions instead of records.
+        Concurrent calls with the same arguments share one computation and the same result objects.
+        """
+        recommendations, _ = await self.recommend(user_id, user_input, n, engine, categories, category_mode, as_positions, budget_ms)
+        return recommendations
+
+    async def recommend(self, user_id, user_input=None, n=10, engine=None, categories=None, category_mode="any", as_positions=False, budget_ms=None):
+        """
+        (recommendations, tier) for the arguments of get_recommendations. With
+        `budget_ms`, a stage not expected to finish within the budget is skipped
+        for a precomputed answer, see fallback_recommendations; tier is "full"
+        when the pipeline ran to the end.
+        """
+        engine = engine or self.default_cf_engine
+        deadline = Deadline(budget_ms, self.stage_estimates)
+        compute = partial(self.compute_recommendations, user_id, user_input, n, engine, categories, category_mode, as_positions, deadline)
+        if self.admission is not None:
+            # Admitted once per distinct computation: coalesced callers do not take a slot
+            compute = partial(self.admitted, self.admission_class(user_id, user_input), deadline, compute)
+        if self.in_flight is not None:
+            # Normalized so that e.g. ["Park", "museum"] and ["museum", "park"] share a computation
+            category_key = frozenset(normalize_category(category) for category in categories) if categories else None
+            key = (user_id, user_input or None, n, engine, category_key, category_mode if category_key else None, as_positions, budget_ms)
+            compute = partial(self.in_flight.do, key, compute)
+        
+        try:
+            # Also a hard stop for any delay the per-stage checks did not foresee
+            return await deadline.bound("pipeline", compute()), "full"
+        except BudgetExhausted as e:
+            recommendations, tier = self.fallback_recommendations(user_id, user_input, n, categories, category_mode, as_positions)
+            DEGRADED.inc(tier, e.stage)
+            logger.info(f"   {budget_ms} ms budget exhausted before stage '{e.stage}', serving the '{tier}' tier.")
+            return recommendations, tier
+
+    def fallback_recommendations(self, user_id, user_input, n, categories, category_mode, as_positions):
+        """
+        (recommendations, tier) from precomputed scores only: the top items of the
+        user's cluster ("cluster"), or popular items ("popular") for guests and
+        users not clustered yet. Rated places and the filters are still applied.
+        """
+        cluster = None
+        if user_id is not None:
+            cluster = self.clusterer.assignments.get(user_id, self.cluster_memberships.get(user_id))
+        scores, tier = self.cluster_fallback_scores.get(cluster), "cluster"
+        if scores is None:
+            scores, tier = self.popularity_prior, "popular"
+        
+        category_mask = self.category_index.mask(categories, category_mode) if categories else None
+        allowed = self.allowed_mask(user_input, category_mask)
+        rated_positions, _ = self.user_history.get(user_id, (np.empty(0, dtype=np.int64), None))
+        positions = top_n(scores, n, exclude=rated_positions, allowed=None if allowed is None else np.flatnonzero(allowed))
+        return (positions if as_positions else self._records_at(positions)), tier
+
+    def admission_class(self, user_id, user_input):
+        """Branch a request will most likely take, known before any scoring: guest_* or the user's segment"""
+        if user_id is None:
+            return "guest_content" if user_input else "guest_popular"
+        rated_positions, _ = self.user_history.get(user_id, ((), ()))
+        return user_segment(len(rated_positions))
+
+    async def admitted(self, branch, deadline, compute):
+        try:
+            async with self.admission.admit(branch, deadline.remaining()):
+                return await compute()
+        except HTTPException as e:
+            # Within a budget, a precomputed answer beats being shed
+            if deadline.bounded and e.status_code == 503:
+                raise BudgetExhausted("admission")
+            raise
+
+    async def compute_recommendations(self, user_id, user_input, n, engine, categories, category_mode, as_positions, deadline):
         try:
+            category_mask = self.category_index.mask(categories, category_mode) if categories else None
+            allowed_ids = None
+            if category_mask is not None:
+                allowed_ids = set(self.tourism_data['locationId'].to_numpy()[category_mask].tolist())
+            
             if user_id is None:
                 logger.info("   User is guest user, serving guest user recommendations.")
                 if not user_input:
-                    return self.get_popular_items(n)
-                return await self.cb.get_content_recommendations(user_input, n)
+                    BRANCH_COUNT.inc("guest_popular")
+                    # In a worker thread, so identical requests arriving meanwhile join this one
+                    with STAGE_LATENCY.time("popular"):
+                        return await deadline.run("popular", asyncio.to_thread(self.get_popular_items, n, allowed_ids))
+                BRANCH_COUNT.inc("guest_content")
+                with STAGE_LATENCY.time("content_based"):
+                    return await deadline.run("content_based", asyncio.to_thread(self.cb.content_recommendations, user_input, n, allowed_ids))
             
-            user_data = await self.user_db.get_user_by_id(user_id)
+            with STAGE_LATENCY.time("get_user"):
+                user_data = self.user_features.get(user_id)
+                if user_data is None:
+                    # Only a cache miss is budgeted as a database lookup
+                    user_data = await deadline.run("get_user", self.get_user_features(user_id))
             if user_data is None:
                 raise HTTPException(status_code=400, detail="User data is not available for the given user_id.")
 
-            user_ratings_count = len(self.ratings[self.ratings['userId'] == user_id])
+            rated_positions, rated_values = self.user_history.get(user_id, (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+            segment = user_segment(len(rated_positions))
             
-            if user_id not in self.ratings['userId'].unique():
-                # New user - use clustering
-                logger.info(f"  User {user_id} is a new user. Using clustering-based recommendations.")
-                
-                # Get cluster value
-                cluster = await self.clusterer.cluster_user(user_id, user_data)
-                # Get cluster peers based on cluster value
-                cluster_users = await self.user_db.get_cluster_peers(cluster)
-                cluster_pd = pd.DataFrame(cluster_users)
-                
-                # Get top-rated items from cluster
-                cluster_ratings = self.ratings[self.ratings['userId'].isin(cluster_pd)]
-                if cluster_ratings.empty:
-                    logger.warning(f"   No ratings found for cluster {cluster}. Using content-based fallback")
-                    return await self.cb.get_content_recommendations(user_input, n)
-                    
-                top_items = (cluster_ratings.groupby('locationId')['rating']
-                            .mean()
-                            .sort_values(ascending=False)
-                            .head(n))
-                
-                logger.info(f"  Top rated items from cluster {cluster}: {top_items}")
-                
-                return self.tourism_data[self.tourism_data['locationId'].isin(top_items.index)].to_dict('records')
-
-            elif user_ratings_count > 15:
-                # Item-based collaborative filtering for Users with > 15 ratings
-                logger.info(f"  User {user_id} has more than 15 ratings. Using collaborative filtering.")
-                return await self.cf.get_collaborative_recommendations(user_id, user_input, n)
-            else:
-                logger.info(f"  User {user_id} has less than or equal to 15 ratings. Using content based filtering")
-                return await self.cb.get_content_recommendations(user_input, n)
+            if user_input and self.cb.is_location_name(user_input):
+                # Searching for a specific place: recommend the places most similar to it
+                if segment == "heavy":
+                    BRANCH_COUNT.inc("collaborative")
+                    with STAGE_LATENCY.time("collaborative"):
+                        return await deadline.run("collaborative", self.cf.get_collaborative_recommendations(user_id, user_input, n, allowed_ids))
+                BRANCH_COUNT.inc("content_based")
+                with STAGE_LATENCY.time("content_based"):
+                    return await deadline.run("content_based", self.cb.get_content_recommendations(user_input, n, allowed_ids))
+            
+            # Every engine scores the whole catalog; the segment decides how much each one counts
+            logger.info(f"  User {user_id} is in segment '{segment}'. Using fused recommendations.")
+            weights = SEGMENT_WEIGHTS[segment]
+            vectors = {"popularity": self.popularity_prior}
+            if "cluster" in weights:
+                vectors["cluster"] = await deadline.run("cluster", self.cluster_scores(user_id, user_data))
+            if "content" in weights:
+                deadline.require("fusion_content")
+                with STAGE_LATENCY.time("fusion_content"), deadline.measure("fusion_content"):
+                    vectors["content"] = self.content_scores(rated_positions, rated_values)
+            if "cf" in weights:
+                deadline.require("fusion_cf")
+                with STAGE_LATENCY.time("fusion_cf"), deadline.measure("fusion_cf"):
+                    vectors["cf"] = self.cf_scores(user_id, rated_positions, rated_values, engine)
+            
+            BRANCH_COUNT.inc(f"fusion_{segment}")
+            deadline.require("fusion")
+            with STAGE_LATENCY.time("fusion"), deadline.measure("fusion"):
+                scores = fuse_scores(vectors, weights)
+                allowed = self.allowed_mask(user_input, category_mask)
+                positions = top_n(scores, n, exclude=rated_positions, allowed=None if allowed is None else np.flatnonzero(allowed))
+                return positions if as_positions else self._records_at(positions)
+        except BudgetExhausted:
+            raise
         except Exception as e:
             logger.error(f" Failed to generate recommendations for user {user_id}: {e}, {traceback.print_exc()}")
             raise HTTPException(status_code=500, detail=f"Failed to generate recommendations: {e}")
+
+    async def get_user_features(self, user_id):
+        """Recommendation-relevant user fields, read through the in-memory cache"""
+        user_data = self.user_features.get(user_id)
+        if user_data is None:
+            user_data = await self.user_db.get_user_features(user_id)
+            if user_data is not None:
+                self.user_features.set(user_id, user_data)
+        return user_data
+
+    def invalidate_user(self, user_id):
+        self.user_features.pop(user_id)
+
+    async def cluster_scores(self, user_id, user_data):
+        """Mean rating of each location among the user's cluster peers, NaN where no peer rated it"""
+        with STAGE_LATENCY.time("cluster_user"):
+            cluster = await self.clusterer.get_cluster(user_id, user_data)
+        with STAGE_LATENCY.time("cluster_peers"):
+            cluster_users = await self.user_db.get_cluster_peers(cluster)
+        
+        with STAGE_LATENCY.time("cluster_ranking"):
+            scores = self.peer_scores(cluster_users)
+            if scores is None:
+                logger.warning(f"   No ratings found for cluster {cluster}. Using popularity only")
+            return scores
+
+    def peer_scores(self, peer_ids):
+        """Mean rating of each location among `peer_ids`, None when none of them rated anything"""
+        peer_ratings = np.isin(self.rating_users, peer_ids)
+        if not peer_ratings.any():
+            return None
+        positions = self.rating_positions[peer_ratings]
+        n_items = len(self.tourism_data)
+        counts = np.bincount(positions, minlength=n_items)
+        sums = np.bincount(positions, weights=self.rating_values[peer_ratings], minlength=n_items)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan).astype(np.float32)
+
+    def content_scores(self, rated_positions, rated_values):
+        """TF-IDF affinity to the user's rating-centred profile"""
+        rows = self.cb_rows[rated_positions]
+        known = rows >= 0
+        weights = rated_values[known] - rated_values[known].mean() if known.any() else rated_values[known]
+        if not np.any(weights):
+            # All ratings equal: every rated place counts as liked
+            weights = rated_values[known]
+        scores = self.cb.profile_scores(rows[known], weights)
+        return self._on_catalog(scores, self.cb_rows)
+
+    def cf_scores(self, user_id, rated_positions, rated_values, engine):
+        """Collaborative scores from matrix factorization or item neighbours"""
+        if engine == "als" and self.als.has_user(user_id):
+            return self._on_catalog(self.als.score_items(user_id), self.als_rows)
+        location_ids = self.tourism_data['locationId'].to_numpy()[rated_positions]
+        return self._on_catalog(self.cf.model.score_items(location_ids, rated_values), self.knn_rows)
+
+    def allowed_mask(self, user_input, category_mask=None):
+        """Boolean mask of the catalog rows matching the search input and category filter, None when unrestricted"""
+        if not user_input:
+            return category_mask
+        if self.cf.is_country(user_input):
+            candidates = self.cf.filter_by_location(self.tourism_data, user_input)
+        else:
+            candidates = self.cf.filter_by_keyword(self.tourism_data, user_input)
+            if candidates.empty:
+                logger.info(f"  No results found for keyword '{user_input}'. Ranking the whole catalog.")
+                return category_mask
+        mask = np.zeros(len(self.tourism_data), dtype=bool)
+        mask[candidates.index.to_numpy()] = True
+        return mask if category_mask is None else mask & category_mask
+
+    def get_category_facets(self, user_input=None, categories=None, category_mode="any"):
+        """Number of locations per category among those matching the search input and category filter"""
+        category_mask = self.category_index.mask(categories, category_mode) if categories else None
+        return self.category_index.facet_counts(self.allowed_mask(user_input, category_mask))
+
+    def build_encoded_rows(self):
+        """Encodes every catalog row as RecommendationsModel JSON once; None where a row does not validate"""
+        encoded_rows = []
+        for record in self._records_at(np.arange(len(self.tourism_data))):
+            try:
+                encoded_rows.append(RecommendationsModel(**record).model_dump_json().encode())
+            except ValueError:
+                encoded_rows.append(None)
+        self.encoded_rows = encoded_rows
+        logger.info(f"   Pre-encoded {sum(row is not None for row in encoded_rows)} catalog rows.")
+
+    def encoded_row(self, location_id):
+        """Pre-encoded JSON of a catalog location, None if unknown or not pre-encoded"""
+        position = self.location_rows.get(location_id)
+        return None if position is None else self.encoded_at(position)
+
+    def encoded_at(self, position):
+        """Pre-encoded JSON of the catalog row at `position`, None if out of range (e.g. after a reload) or not pre-encoded"""
+        encoded_rows = self.encoded_rows
+        if encoded_rows is None or not 0 <= position < len(encoded_rows):
+            return None
+        return encoded_rows[position]
+
+    def _records_at(self, positions):
+        """Catalog rows at the given positions, in the same order"""
+        return [self._clean_dict(item) for item in self.tourism_data.iloc[positions].to_dict('records')]
     
-    def get_popular_items(self, n):
-        if self.ratings.empty:
+    def get_popular_items(self, n, allowed_ids=None):
+        """`allowed_ids` optionally restricts the results to these locationIds"""
+        tourism_data, ratings = self.tourism_data, self.ratings
+        if allowed_ids is not None:
+            tourism_data = tourism_data[tourism_data['locationId'].isin(allowed_ids)]
+            if not ratings.empty:
+                ratings = ratings[ratings['locationId'].isin(allowed_ids)]
+        
+        if ratings.empty:
             # Return tourism data with null ratings converted to None (which becomes null in JSON)
-            return [self._clean_dict(item) for item in self.tourism_data.head(n).to_dict('records')]
+            return [self._clean_dict(item) for item in tourism_data.head(n).to_dict('records')]
             
-        popular_items = (self.ratings.groupby('locationId')['rating']
+        popular_items = (ratings.groupby('locationId')['rating']
                         .mean()
                         .sort_values(ascending=False)
                         .head(n))
         
         # Get the tourism data for popular items
-        result = self.tourism_data[self.tourism_data['locationId'].isin(popular_items.index)]
+        result = tourism_data[tourism_data['locationId'].isin(popular_items.index)]
         
         # Add the average rating to each item
         result = result.merge(
@@ -166,7 +504,9 @@ class HybridFilter:
         """Helper method to convert NaN/None values to None (which becomes null in JSON)"""
         cleaned = {}
         for key, value in item.items():
-            if pd.isna(value):
+            if isinstance(value, (list, np.ndarray)):  # pd.isna is elementwise on lists
+                cleaned[key] = list(value)
+            elif pd.isna(value):
                 cleaned[key] = None
             elif key == 'category' and not value:  # Empty list check for category
                 cleaned[key] = []
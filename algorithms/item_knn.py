@@ -0,0 +1,151 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ItemKNN:
+    """
+    Item-based collaborative filtering with cosine similarity.
+
+    Similarities are computed as sparse products of the column-normalized
+    user x item ratings matrix with its transpose, one block of items at a time
+    on a thread pool, and only the top `k` neighbours of each item are kept as
+    float32. With `shrinkage` > 0 every similarity is scaled by
+    `co_raters / (co_raters + shrinkage)` so pairs backed by few users rank lower.
+    The dense blocks of all workers together stay within `memory_budget_mb`:
+    fewer workers run, and then smaller blocks, when the budget requires it.
+    """
+
+    def __init__(self, k: int = 100, shrinkage: float = 0.0, n_jobs: int = None,
+                 max_block_cells: int = 1 << 24, memory_budget_mb: int = 1024):
+        self.k = k
+        self.shrinkage = shrinkage
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        # Upper bound on the dense block (items x items) materialized per worker
+        self.max_block_cells = max_block_cells
+        self.memory_budget_mb = memory_budget_mb
+        self.item_ids = np.empty(0, dtype=np.int64)
+        self.neighbors = np.empty((0, 0), dtype=np.int32)
+        self.similarities = np.empty((0, 0), dtype=np.float32)
+        self._item_index = {}
+
+    def fit(self, ratings: pd.DataFrame):
+        """Train from a DataFrame with `userId`, `locationId` and `rating` columns"""
+        ratings = ratings.drop_duplicates(subset=['userId', 'locationId'], keep='last')
+        user_codes, _ = pd.factorize(ratings['userId'])
+        item_codes, item_ids = pd.factorize(ratings['locationId'])
+        n_items = len(item_ids)
+
+        matrix = sparse.csr_matrix(
+            (ratings['rating'].to_numpy(dtype=np.float32), (user_codes, item_codes)),
+            shape=(user_codes.max() + 1 if len(user_codes) else 0, n_items),
+        )
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+        norms[norms == 0] = 1.0
+        normalized = (matrix @ sparse.diags(1.0 / norms).astype(np.float32)).tocsc()
+        normalized_t = normalized.T.tocsr()
+
+        binary = binary_t = None
+        if self.shrinkage > 0:
+            binary = (matrix > 0).astype(np.float32).tocsc()
+            binary_t = binary.T.tocsr()
+
+        k = min(self.k, max(n_items - 1, 0))
+        self.neighbors = np.zeros((n_items, k), dtype=np.int32)
+        self.similarities = np.zeros((n_items, k), dtype=np.float32)
+
+        n_jobs, block_cells = self.fit_plan()
+        block_size = max(1, block_cells // max(n_items, 1))
+
+        def fit_block(start):
+            end = min(start + block_size, n_items)
+            block = (normalized_t[start:end] @ normalized).toarray()
+            if binary is not None:
+                co_raters = (binary_t[start:end] @ binary).toarray()
+                block *= co_raters / (co_raters + self.shrinkage)
+            # An item is never its own neighbour
+            block[np.arange(end - start), np.arange(start, end)] = -np.inf
+            if k == 0:
+                return
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            self.neighbors[start:end] = np.take_along_axis(top, order, axis=1)
+            self.similarities[start:end] = np.take_along_axis(top_scores, order, axis=1)
+
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            list(pool.map(fit_block, range(0, n_items, block_size)))
+
+        self.item_ids = np.asarray(item_ids)
+        self._item_index = {item_id: inner for inner, item_id in enumerate(self.item_ids.tolist())}
+        logger.info(f"   Item k-NN trained on {len(ratings)} ratings, {n_items} items, k={k}")
+        return self
+
+    def fit_plan(self):
+        """Workers and dense block cells per worker keeping the fit within `memory_budget_mb`"""
+        # float32 similarities and their negated copy for argpartition, plus co-raters and their weights
+        cell_bytes = 16 if self.shrinkage > 0 else 8
+        budget_cells = max(1, self.memory_budget_mb * (1 << 20) // cell_bytes)
+        n_jobs = max(1, min(self.n_jobs, budget_cells // self.max_block_cells))
+        return n_jobs, min(self.max_block_cells, budget_cells // n_jobs)
+
+    def has_item(self, item_id) -> bool:
+        return item_id in self._item_index
+
+    def get_neighbors(self, item_id, n: int) -> list:
+        """Raw ids of the n most similar items to `item_id`, most similar first"""
+        inner = self._item_index.get(item_id)
+        if inner is None:
+            return []
+        neighbors = self.neighbors[inner, :n]
+        similarities = self.similarities[inner, :n]
+        return self.item_ids[neighbors[similarities > 0]].tolist()
+
+    def score_items(self, item_ids, ratings) -> np.ndarray:
+        """
+        Similarity-weighted rating of every item in `item_ids` order, for a user
+        who rated `item_ids` with `ratings`. Items outside every rated item's
+        neighbourhood are NaN.
+        """
+        scores = np.zeros(len(self.item_ids), dtype=np.float32)
+        weights = np.zeros(len(self.item_ids), dtype=np.float32)
+        inner = [self._item_index.get(item_id, -1) for item_id in item_ids]
+        rated = np.asarray(inner, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float32)[rated >= 0]
+        rated = rated[rated >= 0]
+        if len(rated) == 0 or self.neighbors.shape[1] == 0:
+            return np.full(len(self.item_ids), np.nan, dtype=np.float32)
+
+        neighbors = self.neighbors[rated]
+        similarities = np.maximum(self.similarities[rated], 0)
+        np.add.at(scores, neighbors.ravel(), (similarities * ratings[:, None]).ravel())
+        np.add.at(weights, neighbors.ravel(), similarities.ravel())
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(weights > 0, scores / weights, np.nan).astype(np.float32)
+
+    def save(self, path):
+        np.savez(
+            path,
+            item_ids=self.item_ids,
+            neighbors=self.neighbors,
+            similarities=self.similarities,
+            params=np.array([self.k, self.shrinkage], dtype=np.float64),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            k, shrinkage = data['params']
+            model = cls(k=int(k), shrinkage=float(shrinkage))
+            model.item_ids = data['item_ids']
+            model.neighbors = data['neighbors']
+            model.similarities = data['similarities']
+        model._item_index = {item_id: inner for inner, item_id in enumerate(model.item_ids.tolist())}
+        return model
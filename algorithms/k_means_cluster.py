@@ -1,32 +1,88 @@
 import ast
+import copy
 import logging
+import os
 import pandas as pd
 from joblib import load, dump
 from pathlib import Path
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.preprocessing import FunctionTransformer, OneHotEncoder, StandardScaler
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
 from typing import Dict, Optional
 
+from algorithms.artifacts import DataFingerprint, artifact_path, save_in_background
 from db.user_db import UserCommands
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Columns the clustering features are computed from, see add_text_features
+FEATURE_COLUMNS = ['userId', 'ageGroup', 'location', 'job', 'gender', 'env_features', 'food_features', 'act_features']
+DEMOGRAPHIC_COLUMNS = ['ageGroup', 'location', 'job', 'gender']
+
+
+DEMOGRAPHIC_HASHER = FeatureHasher(n_features=2 ** 8, input_type='string', alternate_sign=False)
+
+
+def hash_demographics(frame: pd.DataFrame):
+    """Hashed `column=value` token of each demographic field, the streaming counterpart of one-hot encoding"""
+    return DEMOGRAPHIC_HASHER.transform(
+        [f"{column}={value}" for column, value in zip(DEMOGRAPHIC_COLUMNS, row)]
+        for row in frame[DEMOGRAPHIC_COLUMNS].itertuples(index=False)
+    )
+
 
 class UserClusterer:
     def __init__(self):
         self.models_loaded = False
         self.MODEL_PATH = Path(__file__).parent
+        # Feature pipeline and centroids saved together, named after the clustering settings
+        self.MODEL_FILE = self.MODEL_PATH / 'user_clusters.joblib'
+        self.model_file = self.MODEL_FILE
         self.users_df = None
         self.user_db = UserCommands()
+        # userId -> cluster, refreshed whenever a user's clustering features change
+        self.assignments = {}
+        # Fingerprint digest of the users the loaded centroids were fitted on; clusters
+        # stored in MongoDB are only reused when they were computed by this version
+        self.model_version = None
+        
+        # "full" refits KMeans on every user at once, "streaming" fits MiniBatchKMeans chunk by chunk
+        self.mode = os.getenv("CLUSTER_MODE", "full")
+        self.batch_size = int(os.getenv("CLUSTER_BATCH_SIZE", 1024))
+        # Users queued by observe_user before the centroids are updated
+        self.update_batch_size = int(os.getenv("CLUSTER_UPDATE_BATCH_SIZE", 32))
+        self._pending_updates = []
+        # Summary of the users the current models were fitted on, and users folded in since
+        self.trained_on = None
+        self.updated_users = 0
     
     async def initialize(self):
-        """Async initialization that handles nested profile structure"""
+        """
+        Loads the models saved for the current settings. Users registered since
+        they were fitted are clustered with them as they are seen; refitting is an
+        explicit step (POST /admin/clusters/refit), not a side effect of new users.
+        """
+        self.model_file = artifact_path(self.MODEL_FILE, self.new_fingerprint())
+        try:
+            self.load_models()
+            return
+        except FileNotFoundError:
+            logger.info("No existing models found. Creating new ones...")
+        if self.mode == "streaming":
+            # Never holds the whole user base in memory
+            await self.fit_streaming()
+            return
         self.users_df = await self.load_users_data()
-        self.load_or_create_models()
+        self.create_and_save_models()
+        self.models_loaded = True
+
+    def new_fingerprint(self, **params) -> DataFingerprint:
+        """Empty fingerprint of the clustering settings, plus the `params` of a fit"""
+        return DataFingerprint(['userId'], {"mode": self.mode, "batch_size": self.batch_size, **params})
     
     async def load_users_data(self) -> pd.DataFrame:
         """Load user data from database and flatten profile structure"""
@@ -37,42 +93,57 @@ class UserClusterer:
             logger.warning("No users found in database")
             return pd.DataFrame()
         
+        return self.users_to_frame(users_list)
+    
+    def users_to_frame(self, users_list) -> pd.DataFrame:
         # Convert to DataFrame and handle nested profile
         df = pd.DataFrame(users_list)
         
         # Extract profile fields if they exist
         if 'profile' in df.columns:
-            profile_df = pd.json_normalize(df['profile'])
+            profile_df = pd.json_normalize(df['profile'].apply(lambda profile: profile or {}).tolist())
             # Merge profile fields into main dataframe
             df = pd.concat([df.drop(['profile'], axis=1), profile_df], axis=1)
         
         return df
     
-    def load_or_create_models(self):
-        """Load existing models or create new ones if they don't exist"""
-        try:
-            self.preprocessor = load(self.MODEL_PATH / 'feature_pipeline.joblib')
-            self.kmeans = load(self.MODEL_PATH / 'cluster_model.joblib')
-            self.models_loaded = True
-            logger.info("   Loaded existing clustering models")
-        except FileNotFoundError:
-            logger.info("No existing models found. Creating new ones...")
-            self.create_and_save_models()
-            self.models_loaded = True
+    async def stream_user_frames(self, chunk_size: int):
+        """Yields users as feature-ready DataFrames of at most `chunk_size` rows, read from a Motor cursor"""
+        chunk = []
+        async for user in self.user_db.get_all_users().batch_size(chunk_size):
+            chunk.append(user)
+            if len(chunk) == chunk_size:
+                yield self.add_text_features(self.users_to_frame(chunk))
+                chunk = []
+        if chunk:
+            yield self.add_text_features(self.users_to_frame(chunk))
+    
+    def load_models(self):
+        models = load(self.model_file)
+        self.preprocessor = models['preprocessor']
+        self.kmeans = models['kmeans']
+        self.model_version = models['version']
+        self.trained_on = models['trained_on']
+        self.updated_users = models['updated_users']
+        self.models_loaded = True
+        logger.info("   Loaded existing clustering models")
 
-    def create_and_save_models(self, n_clusters: int = 5):
-        """Create new clustering models from training data"""
-        if self.users_df is None or self.users_df.empty:
-            raise ValueError("User data not loaded or empty. Call initialize() first.")
-        
+    def add_text_features(self, users_df: pd.DataFrame) -> pd.DataFrame:
+        """Adds the preference text columns the preprocessor vectorizes"""
         # Process preferences with fallbacks
-        processed_prefs = self.users_df["preferences"].apply(self.process_preferences)
+        preferences = users_df["preferences"] if "preferences" in users_df.columns else pd.Series([None] * len(users_df))
+        processed_prefs = preferences.apply(self.process_preferences)
         
         # Create text features from preferences
-        self.users_df["env_features"] = processed_prefs.apply(lambda x: " ".join(x["environments"]))
-        self.users_df["food_features"] = processed_prefs.apply(lambda x: " ".join(x["food"]))
-        self.users_df["act_features"] = processed_prefs.apply(lambda x: " ".join(x["activities"]))
-        
+        users_df["env_features"] = processed_prefs.apply(lambda x: " ".join(x["environments"])).to_numpy()
+        users_df["food_features"] = processed_prefs.apply(lambda x: " ".join(x["food"])).to_numpy()
+        users_df["act_features"] = processed_prefs.apply(lambda x: " ".join(x["activities"])).to_numpy()
+        for column in DEMOGRAPHIC_COLUMNS:
+            if column not in users_df.columns:
+                users_df[column] = None
+        return users_df
+
+    def build_preprocessor(self) -> ColumnTransformer:
         # Configure vectorizers
         vectorizer_params = {
             'min_df': 1,
@@ -82,7 +153,7 @@ class UserClusterer:
         }
         
         # Define preprocessing pipeline
-        self.preprocessor = ColumnTransformer(
+        return ColumnTransformer(
             transformers=[
                 ('env_tfidf', TfidfVectorizer(**vectorizer_params), 'env_features'),
                 ('food_tfidf', TfidfVectorizer(**vectorizer_params), 'food_features'),
@@ -94,6 +165,34 @@ class UserClusterer:
             ],
             remainder='drop'
         )
+
+    def build_streaming_preprocessor(self) -> ColumnTransformer:
+        """
+        Stateless counterpart of build_preprocessor for streamed users: terms and
+        demographic values are hashed into fixed-width features instead of being
+        learned from the data, so words or categories that first appear in a late
+        chunk are not dropped and the features do not depend on document order.
+        """
+        def text_hasher():
+            return HashingVectorizer(n_features=2 ** 10, alternate_sign=False, token_pattern=r'(?u)\b\w+\b')
+        
+        return ColumnTransformer(
+            transformers=[
+                ('env_hash', text_hasher(), 'env_features'),
+                ('food_hash', text_hasher(), 'food_features'),
+                ('act_hash', text_hasher(), 'act_features'),
+                ('demographics', FunctionTransformer(hash_demographics), DEMOGRAPHIC_COLUMNS)
+            ],
+            remainder='drop'
+        )
+
+    def create_and_save_models(self, n_clusters: int = 5):
+        """Create new clustering models from training data"""
+        if self.users_df is None or self.users_df.empty:
+            raise ValueError("User data not loaded or empty. Call initialize() first.")
+        
+        self.users_df = self.add_text_features(self.users_df)
+        self.preprocessor = self.build_preprocessor()
         
         # Fit the preprocessor
         features = self.preprocessor.fit_transform(self.users_df)
@@ -101,12 +200,93 @@ class UserClusterer:
         # Create and fit KMeans model
         self.kmeans = KMeans(n_clusters=n_clusters, random_state=42)
         self.kmeans.fit(features)
+        self.set_fitted(self.new_fingerprint(n_clusters=n_clusters).update(self.users_df[FEATURE_COLUMNS]))
         
-        # Save models
-        dump(self.preprocessor, self.MODEL_PATH / 'feature_pipeline.joblib')
-        dump(self.kmeans, self.MODEL_PATH / 'cluster_model.joblib')
+        self.save_models()
         logger.info(f"Created and saved new clustering models with {n_clusters} clusters")
 
+    def set_fitted(self, data_fingerprint: DataFingerprint):
+        """Records the users a fresh fit was trained on; clusters stored by earlier models are no longer trusted"""
+        self.trained_on = data_fingerprint.summary()
+        self.updated_users = 0
+        self.model_version = data_fingerprint.digest()
+        self.assignments.clear()
+        self._pending_updates = []
+
+    def save_models(self):
+        """Saves in the background; the centroids are copied since partial_fit keeps updating them"""
+        models = {
+            'preprocessor': self.preprocessor,
+            'kmeans': copy.deepcopy(self.kmeans),
+            'version': self.model_version,
+            'trained_on': self.trained_on,
+            'updated_users': self.updated_users,
+        }
+        return save_in_background(self.model_file, lambda path: dump(models, path))
+
+    async def fit_streaming(self, n_clusters: int = 5, warm_start: bool = False):
+        """
+        Fit MiniBatchKMeans over users streamed in chunks of `batch_size`, so
+        memory is bounded by one chunk. Features come from the stateless
+        build_streaming_preprocessor unless warm starting, in which case the current
+        pipeline is kept and the current centroids seed the new model.
+        """
+        init = 'k-means++'
+        if warm_start and self.models_loaded:
+            init = self.kmeans.cluster_centers_
+            n_clusters = len(init)
+        
+        # The first partial_fit needs at least one user per cluster
+        chunks = self.stream_user_frames(self.batch_size)
+        first = pd.DataFrame()
+        while len(first) < n_clusters:
+            chunk = await anext(chunks, None)
+            if chunk is None:
+                break
+            first = pd.concat([first, chunk], ignore_index=True)
+        if first.empty:
+            raise ValueError("No users found in database")
+        if len(first) < n_clusters:
+            raise ValueError(f"Only {len(first)} users found, fewer than the {n_clusters} clusters")
+        
+        if not (warm_start and self.models_loaded):
+            self.preprocessor = self.build_streaming_preprocessor().fit(first)
+        
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=1 if warm_start else 3,
+                                 batch_size=self.batch_size, random_state=42)
+        kmeans.partial_fit(self.preprocessor.transform(first))
+        data_fingerprint = self.new_fingerprint(n_clusters=n_clusters, warm_start=warm_start).update(first[FEATURE_COLUMNS])
+        async for chunk in chunks:
+            kmeans.partial_fit(self.preprocessor.transform(chunk))
+            data_fingerprint.update(chunk[FEATURE_COLUMNS])
+        n_users = data_fingerprint.rows
+        
+        self.kmeans = kmeans
+        self.models_loaded = True
+        self.set_fitted(data_fingerprint)
+        self.save_models()
+        logger.info(f"Fitted streaming clustering model with {n_clusters} clusters on {n_users} users")
+
+    async def observe_user(self, user_data: Dict):
+        """
+        Queue a registered user, or one moved to another cluster (see reassign_user),
+        for an incremental `partial_fit` of the centroids, applied once
+        `update_batch_size` users are queued. Only the streaming (MiniBatchKMeans)
+        model supports this; otherwise it is a no-op.
+        """
+        if not self.models_loaded or not hasattr(self.kmeans, 'partial_fit'):
+            return
+        self._pending_updates.append(self.prepare_new_user(user_data))
+        if len(self._pending_updates) < self.update_batch_size:
+            return
+        
+        batch = pd.concat(self._pending_updates, ignore_index=True)
+        self._pending_updates = []
+        self.kmeans.partial_fit(self.preprocessor.transform(batch))
+        self.updated_users += len(batch)
+        self.save_models()
+        logger.info(f"Updated cluster centroids with {len(batch)} new or changed users")
+
     def process_preferences(self, pref_dict: Optional[Dict]) -> Dict:
         """Ensure preferences dict has all required keys and non-empty values"""
         if not isinstance(pref_dict, dict):
@@ -121,10 +301,10 @@ class UserClusterer:
     def prepare_new_user(self, user_data: Dict) -> pd.DataFrame:
         """Convert raw user data to model-ready format, handling nested profile"""
         # Extract profile data (default to empty dict if not present)
-        profile_data = user_data.get('profile', {})
+        profile_data = user_data.get('profile') or {}
         
-        # Process preferences with fallbacks
-        prefs = user_data.get('preferences', {})
+        # Process preferences with fallbacks (freshly registered users have none yet)
+        prefs = user_data.get('preferences') or {}
         if isinstance(prefs, str):
             try:
                 prefs = ast.literal_eval(prefs)
@@ -132,18 +312,48 @@ class UserClusterer:
                 prefs = {}
         
         # Build feature DataFrame matching training structure
+        def profile_value(key, default):
+            value = profile_data.get(key)
+            return default if value is None else value
+        
         return pd.DataFrame([{
-            'ageGroup': profile_data.get('ageGroup', 0),
-            'location': profile_data.get('location', 'unknown'),
-            'job': profile_data.get('job', 'unknown'),
-            'gender': profile_data.get('gender', 'unknown'),
+            'ageGroup': profile_value('ageGroup', 0),
+            'location': profile_value('location', 'unknown'),
+            'job': profile_value('job', 'unknown'),
+            'gender': profile_value('gender', 'unknown'),
             'env_features': ' '.join(prefs.get('environments', ['unknown_env'])),
             'food_features': ' '.join(prefs.get('food', ['unknown_food'])),
             'act_features': ' '.join(prefs.get('activities', ['unknown_act']))
         }])
 
+    async def get_cluster(self, user_id: int, user_data: Dict) -> int:
+        """Cached cluster of a user, only running the model the first time a user is seen"""
+        cluster_val = self.assignments.get(user_id)
+        if cluster_val is not None:
+            return cluster_val
+        stored_version = user_data.get('clusterModel')
+        if user_data.get('cluster') is not None and stored_version is not None and stored_version == self.model_version:
+            self.assignments[user_id] = int(user_data['cluster'])
+            return self.assignments[user_id]
+        return await self.cluster_user(user_id, user_data)
+
+    async def reassign_user(self, user_id: int, user_data: Dict) -> int:
+        """
+        Clusters a user whose clustering features changed. The user is fed to the
+        centroids only when the change moves them to another cluster, so users who
+        edit their profile often are not counted again and again.
+        """
+        previous = self.assignments.get(user_id, user_data.get('cluster'))
+        cluster_val = await self.cluster_user(user_id, user_data)
+        if previous is not None and cluster_val != previous:
+            await self.observe_user(user_data)
+        return cluster_val
+
+    def forget_user(self, user_id: int):
+        self.assignments.pop(user_id, None)
+
     async def cluster_user(self, user_id: int, user_data: Dict) -> int:
-        """Cluster a single new user and update database"""
+        """Cluster a single user, cache the result and update the database when the cluster changed"""
         if not self.models_loaded:
             await self.initialize()
         
@@ -151,9 +361,13 @@ class UserClusterer:
             user_df = self.prepare_new_user(user_data)
             features = self.preprocessor.transform(user_df)
             cluster_val = int(self.kmeans.predict(features)[0])
+            self.assignments[user_id] = cluster_val
+            
+            if user_data.get('cluster') == cluster_val and user_data.get('clusterModel') == self.model_version:
+                return cluster_val
             
             # Update user cluster in database
-            result = await self.user_db.update_user_cluster(user_id, cluster_val)
+            result = await self.user_db.update_user_cluster(user_id, cluster_val, self.model_version)
             if result:
                 logger.info(f"User {user_id} assigned to cluster {cluster_val}")
             else:
@@ -169,11 +383,9 @@ class UserClusterer:
         if not self.models_loaded:
             await self.initialize()
         
-        users_cursor = self.user_db.get_all_users()
-        users_list = await users_cursor.to_list(length=None)
-        
         results = {}
-        for user in users_list:
+        # Iterate the cursor rather than loading every user at once
+        async for user in self.user_db.get_all_users().batch_size(self.batch_size):
             try:
                 cluster = await self.cluster_user(user['userId'], user)
                 results[user['userId']] = cluster
@@ -0,0 +1,158 @@
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from typing import List, NamedTuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, accents stripped, punctuation collapsed to single spaces"""
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return " ".join(_TOKEN.findall(ascii_name.lower()))
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameMatch(NamedTuple):
+    locationId: int
+    name: str
+    score: float
+    match: str  # "exact", "prefix", "token" or "fuzzy"
+
+
+class NameIndex:
+    """
+    In-memory index over location names for exact, prefix and typo-tolerant lookups.
+
+    Normalized full names and name tokens are kept in sorted arrays, so exact
+    and prefix matches are binary searches. Fuzzy matches come from a trigram
+    inverted index: only the postings of the query's trigrams are visited, and
+    candidates are ranked by Dice similarity. A name scores the best of its
+    whole-name similarity and the mean similarity of each query token to its
+    closest name token, so a misspelled word still finds a multi-word name.
+    No lookup scans the catalog.
+    """
+
+    # Ranking tiers; within a tier shorter names (closer to the query) come first
+    TIERS = {"exact": 3.0, "prefix": 2.0, "token": 1.0}
+
+    def __init__(self, location_ids, names, min_similarity: float = 0.4):
+        self.location_ids = np.asarray(location_ids)
+        self.names = [str(name) for name in names]
+        self.min_similarity = min_similarity
+        normalized = [normalize_name(name) for name in self.names]
+        self.lengths = np.array([len(name) for name in normalized])
+
+        self.sorted_names = sorted((name, row) for row, name in enumerate(normalized) if name)
+        self._sorted_name_keys = [name for name, _ in self.sorted_names]
+        self.sorted_tokens = sorted({(token, row) for row, name in enumerate(normalized) for token in name.split()})
+        self._sorted_token_keys = [token for token, _ in self.sorted_tokens]
+
+        self.trigram_postings = defaultdict(list)
+        self.trigram_counts = np.zeros(len(normalized), dtype=np.int32)
+        for row, name in enumerate(normalized):
+            grams = trigrams(name) if name else set()
+            self.trigram_counts[row] = len(grams)
+            for gram in grams:
+                self.trigram_postings[gram].append(row)
+
+        # Same inverted index over the distinct name tokens, each listing its rows
+        self.tokens = sorted({token for name in normalized for token in name.split()})
+        token_ids = {token: index for index, token in enumerate(self.tokens)}
+        self.token_rows = [[] for _ in self.tokens]
+        for token, row in self.sorted_tokens:
+            self.token_rows[token_ids[token]].append(row)
+        self.token_trigram_postings = defaultdict(list)
+        self.token_trigram_counts = np.zeros(len(self.tokens), dtype=np.int32)
+        for index, token in enumerate(self.tokens):
+            grams = trigrams(token)
+            self.token_trigram_counts[index] = len(grams)
+            for gram in grams:
+                self.token_trigram_postings[gram].append(index)
+
+    @staticmethod
+    def _prefix_range(keys, prefix):
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + "\uffff", start)
+        return start, end
+
+    def _prefix_rows(self, prefix: str) -> set:
+        start, end = self._prefix_range(self._sorted_name_keys, prefix)
+        return {row for _, row in self.sorted_names[start:end]}
+
+    def _token_rows(self, tokens) -> set:
+        """Rows with, for every query token, a name token starting with it"""
+        rows = None
+        for token in tokens:
+            start, end = self._prefix_range(self._sorted_token_keys, token)
+            token_rows = {row for _, row in self.sorted_tokens[start:end]}
+            rows = token_rows if rows is None else rows & token_rows
+            if not rows:
+                return set()
+        return rows or set()
+
+    @staticmethod
+    def _dice(text: str, postings, counts) -> dict:
+        """Dice similarity of `text` to every entry sharing a trigram with it, visiting only those postings"""
+        grams = trigrams(text)
+        shared = defaultdict(int)
+        for gram in grams:
+            for entry in postings.get(gram, ()):
+                shared[entry] += 1
+        return {entry: 2 * count / (len(grams) + counts[entry]) for entry, count in shared.items()}
+
+    def _fuzzy_rows(self, query: str) -> dict:
+        similarities = self._dice(query, self.trigram_postings, self.trigram_counts)
+        query_tokens = query.split()
+        token_scores = defaultdict(float)
+        for query_token in query_tokens:
+            best = {}
+            for index, similarity in self._dice(query_token, self.token_trigram_postings, self.token_trigram_counts).items():
+                for row in self.token_rows[index]:
+                    if similarity > best.get(row, 0.0):
+                        best[row] = similarity
+            for row, similarity in best.items():
+                token_scores[row] += similarity / len(query_tokens)
+        for row, score in token_scores.items():
+            if score > similarities.get(row, 0.0):
+                similarities[row] = score
+        return {row: similarity for row, similarity in similarities.items() if similarity >= self.min_similarity}
+
+    def search(self, query: str, limit: int = 10, fuzzy: bool = True) -> List[NameMatch]:
+        """Best matches for `query`, ranked exact > name prefix > token prefix > fuzzy"""
+        normalized = normalize_name(query)
+        if not normalized or limit <= 0:
+            return []
+
+        scores = {}
+        for row in self._prefix_rows(normalized):
+            tier = "exact" if self.lengths[row] == len(normalized) else "prefix"
+            scores[row] = (self.TIERS[tier] + 1 / (1 + self.lengths[row]), tier)
+        for row in self._token_rows(normalized.split()):
+            if row not in scores:
+                scores[row] = (self.TIERS["token"] + 1 / (1 + self.lengths[row]), "token")
+        if fuzzy and len(scores) < limit:
+            for row, similarity in self._fuzzy_rows(normalized).items():
+                if row not in scores:
+                    scores[row] = (similarity, "fuzzy")
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+        return [
+            NameMatch(int(self.location_ids[row]), self.names[row], float(score), match)
+            for row, (score, match) in ranked
+        ]
+
+    def lookup(self, name: str):
+        """
+        locationId of the best exact, prefix or token match for `name`, None otherwise.
+        Fuzzy matches are never resolved silently: they may well be another place, see search.
+        """
+        matches = self.search(name, limit=1, fuzzy=False)
+        return matches[0].locationId if matches else None
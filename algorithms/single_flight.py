@@ -0,0 +1,54 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+from monitoring import metrics
+
+SHARED_RESULTS = metrics.counter(
+    "single_flight_shared_total",
+    "Calls answered with the result of an identical call already in flight instead of computing their own",
+    ("operation",),
+)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts the
+    computation and every caller arriving before it finishes awaits the same
+    result (or exception). Nothing is kept once the call completes, so this is
+    not a cache. The computation runs as its own task, so a caller that gives up
+    (e.g. a disconnected client or an exhausted latency budget) does not cancel
+    it for the others; it is cancelled once the last caller has given up.
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self._in_flight = {}
+        # key -> number of callers awaiting the computation
+        self._waiters = {}
+
+    async def do(self, key: Hashable, compute: Callable[[], Awaitable]):
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._in_flight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            SHARED_RESULTS.inc(self.operation)
+        
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self._in_flight.get(key) is task:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0 and not task.done():
+                    task.cancel()
+
+    def _forget(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+            del self._waiters[key]
+
+    def __len__(self):
+        return len(self._in_flight)
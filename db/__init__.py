@@ -1,4 +1,6 @@
 from .recommender_db import RecommenderCommands
 from .location_db import LocationCommands
 from .user_db import UserCommands
-from .connections import ConnectionManager
\ No newline at end of file
+from .connections import ConnectionManager
+from .cache import LocationCache, TTLCache
+from .rating_buffer import RatingWriteBuffer
\ No newline at end of file
@@ -0,0 +1,111 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from db.location_db import LocationCommands
+from models.locations import LocationModel
+from monitoring import metrics
+
+load_dotenv()
+
+CACHE_REQUESTS = metrics.counter(
+    "location_cache_requests_total",
+    "Location lookups served from the in-process cache (hit) or MongoDB (miss)",
+    ("result",),
+)
+
+
+class TTLCache:
+    """Size-bounded LRU mapping whose entries also expire `ttl` seconds after being stored"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LocationCache:
+    """
+    Read-through cache in front of LocationCommands for the location detail routes.
+
+    Entries are stored as validated LocationModel instances keyed by locationId,
+    so a hit touches neither MongoDB nor the title-casing done by
+    LocationCommands. Lookups that find nothing are not cached. Names are
+    resolved to ids in memory by the recommender's NameIndex.
+    """
+
+    def __init__(self, location_db: Optional[LocationCommands] = None, max_size: int = None, ttl: float = None):
+        self.location_db = location_db or LocationCommands()
+        max_size = max_size or int(os.getenv("LOCATION_CACHE_SIZE", 10000))
+        ttl = ttl or float(os.getenv("LOCATION_CACHE_TTL_SECONDS", 3600))
+        self.by_id = TTLCache(max_size, ttl)
+        # locationId -> LocationModel JSON, filled on demand by get_encoded_by_id
+        self.encoded_by_id = TTLCache(max_size, ttl)
+
+    async def get_by_id(self, location_id: int) -> Optional[LocationModel]:
+        location = self.by_id.get(location_id)
+        if location is not None:
+            CACHE_REQUESTS.inc("hit")
+            return location
+
+        CACHE_REQUESTS.inc("miss")
+        location_detail = await self.location_db.get_location_by_id(location_id)
+        if location_detail is None:
+            return None
+        location = LocationModel(**location_detail)
+        self.by_id.set(location_id, location)
+        # The document may have changed since it was encoded
+        self.encoded_by_id.pop(location_id)
+        return location
+
+    async def get_encoded_by_id(self, location_id: int) -> Optional[bytes]:
+        """Like get_by_id, but as JSON bytes encoded once per cached location"""
+        encoded = self.encoded_by_id.get(location_id)
+        if encoded is not None:
+            CACHE_REQUESTS.inc("hit")
+            return encoded
+        location = await self.get_by_id(location_id)
+        if location is None:
+            return None
+        encoded = location.model_dump_json().encode()
+        self.encoded_by_id.set(location_id, encoded)
+        return encoded
+
+    def invalidate(self, location_id: Optional[int] = None):
+        """Drops every entry for `location_id`, or the whole cache when no id is given"""
+        if location_id is None:
+            self.by_id.clear()
+            self.encoded_by_id.clear()
+        else:
+            self.by_id.pop(location_id)
+            self.encoded_by_id.pop(location_id)
+
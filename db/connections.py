@@ -4,6 +4,8 @@ from typing import Optional
 import motor.motor_asyncio as motor
 from dotenv import load_dotenv
 
+from monitoring.queries import query_listener
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
@@ -28,9 +30,15 @@ class ConnectionManager:
         self.DB_PASSWORD_LOCATION = os.getenv('DB_PASSWORD_LOCATION')
         self.USER_MONGO_URI = os.getenv('USER_MONGO_URI')
         self.LOCATION_MONGO_URI = os.getenv('LOCATION_MONGO_URI')
+        # Points both clients at a local MongoDB (e.g. mongodb://localhost:27017) for load tests
+        self.LOCAL_MONGO_URI = os.getenv('LOCAL_MONGO_URI')
         
-        self.MONGO_USER_URI = f"mongodb+srv://{self.DB_USERNAME}:{self.DB_PASSWORD_USER}@{self.USER_MONGO_URI}"
-        self.MONGO_LOCATION_URI = f"mongodb+srv://{self.DB_USERNAME}:{self.DB_PASSWORD_LOCATION}@{self.LOCATION_MONGO_URI}"
+        if self.LOCAL_MONGO_URI:
+            self.MONGO_USER_URI = self.LOCAL_MONGO_URI
+            self.MONGO_LOCATION_URI = self.LOCAL_MONGO_URI
+        else:
+            self.MONGO_USER_URI = f"mongodb+srv://{self.DB_USERNAME}:{self.DB_PASSWORD_USER}@{self.USER_MONGO_URI}"
+            self.MONGO_LOCATION_URI = f"mongodb+srv://{self.DB_USERNAME}:{self.DB_PASSWORD_LOCATION}@{self.LOCATION_MONGO_URI}"
         
         # Initialize clients
         self.user_client: Optional[motor.AsyncIOMotorClient] = None
@@ -46,8 +54,9 @@ class ConnectionManager:
     def _connect(self):
         """Establish database connections"""
         try:
-            self.user_client = motor.AsyncIOMotorClient(self.MONGO_USER_URI)
-            self.location_client = motor.AsyncIOMotorClient(self.MONGO_LOCATION_URI)
+            # query_listener attributes every command to the request that issued it
+            self.user_client = motor.AsyncIOMotorClient(self.MONGO_USER_URI, event_listeners=[query_listener])
+            self.location_client = motor.AsyncIOMotorClient(self.MONGO_LOCATION_URI, event_listeners=[query_listener])
             
             self.user_db = self.user_client["users_db"]
             self.recommender_db = self.user_client["recommender_system"]
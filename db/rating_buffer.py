@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Iterable, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from db.recommender_db import RecommenderCommands
+from models.recommendations import RatingModel
+from monitoring import metrics
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FLUSH_SIZE = metrics.histogram(
+    "rating_buffer_flush_size",
+    "Ratings written per bulk_write flush of the rating write buffer",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000),
+)
+COALESCED = metrics.counter(
+    "rating_buffer_coalesced_total",
+    "Rating writes absorbed by a later write to the same (userId, locationId) before being flushed",
+)
+
+
+class RatingWriteBuffer:
+    """
+    Coalescing write-behind buffer for user ratings.
+
+    Submitted ratings are kept per (userId, locationId), so repeated writes to
+    the same pair collapse into the latest one. The buffer is flushed as one
+    unordered `bulk_write` of upserts when it holds `max_batch` ratings or every
+    `flush_interval` seconds, whichever comes first. `submit` returns once the
+    flush containing its ratings is written, so callers still see write errors.
+    When `max_pending` ratings are waiting, submitters flush first (backpressure).
+    Single ratings are written right away with `write` instead of waiting for a
+    flush. They are only ordered with the other writes to the same pair, so they
+    never wait behind a flush of unrelated ratings.
+    """
+
+    def __init__(self, recommender_db: Optional[RecommenderCommands] = None, max_batch: int = None,
+                 flush_interval: float = None, max_pending: int = None):
+        self.recommender_db = recommender_db or RecommenderCommands()
+        self.max_batch = max_batch or int(os.getenv("RATING_BUFFER_MAX_BATCH", 500))
+        self.flush_interval = flush_interval or float(os.getenv("RATING_BUFFER_FLUSH_MS", 200)) / 1000
+        self.max_pending = max_pending or int(os.getenv("RATING_BUFFER_MAX_PENDING", 10000))
+        self._pending = {}
+        # Pending ratings dropped by `delete` before their flush, reported back to their submitters
+        self._deleted = {}
+        # Resolved with the flushed and deleted ratings once those currently pending have been written
+        self._batch_done = None
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        # (userId, locationId) -> done future of the flush writing that pair
+        self._flushing = {}
+        # (userId, locationId) -> [lock, holders] ordering the single writes of that pair
+        self._pair_locks = {}
+        # (userId, locationId) -> future resolved when the single write in progress ends
+        self._writing = {}
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the periodic flush and writes whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def submit(self, ratings: Iterable[RatingModel]) -> Tuple[int, int]:
+        """
+        Buffers `ratings` and waits until they are written. Returns how many distinct
+        (userId, locationId) pairs were saved, by this call or a later write to the
+        same pair, and how many were deleted before they could be written.
+        """
+        while len(self._pending) >= self.max_pending:
+            await self.flush()
+
+        if self._batch_done is None:
+            self._batch_done = asyncio.get_running_loop().create_future()
+        done = self._batch_done
+        submitted = {}
+        for rating in ratings:
+            rating_dict = rating.model_dump()
+            key = (rating_dict["userId"], rating_dict["locationId"])
+            if key in self._pending:
+                COALESCED.inc()
+            self._pending[key] = submitted[key] = rating_dict
+
+        if self._task is None:
+            # Not started (e.g. outside the app lifespan): write through
+            await self.flush()
+        elif len(self._pending) >= self.max_batch:
+            self._wake.set()
+        _, deleted = await asyncio.shield(done)
+        n_deleted = sum(deleted.get(key) is rating_dict for key, rating_dict in submitted.items())
+        return len(submitted) - n_deleted, n_deleted
+
+    async def write(self, rating: RatingModel):
+        """
+        Upserts one rating without waiting for a flush; a pending write to the same
+        pair is superseded, and a flush already writing it finishes first.
+        """
+        rating_dict = rating.model_dump()
+        key = (rating_dict["userId"], rating_dict["locationId"])
+        if self._pending.pop(key, None) is not None:
+            COALESCED.inc()
+        async with self._writing_pair(key):
+            return await self.recommender_db.upsert_user_rating(rating_dict)
+
+    async def delete(self, user_id: int, location_id: int):
+        """
+        Deletes a rating, dropping it from the buffer first so a later flush cannot
+        bring it back; a flush already writing it finishes first.
+        """
+        key = (user_id, location_id)
+        was_pending = key in self._pending
+        if was_pending:
+            self._deleted[key] = self._pending.pop(key)
+        async with self._writing_pair(key):
+            try:
+                return await self.recommender_db.delete_user_rating(user_id, location_id)
+            except HTTPException as e:
+                # A rating that was only pending is deleted too, it just never reached MongoDB
+                if e.status_code != 404 or not was_pending:
+                    raise
+                return {"message": "Successfully deleted user's rating."}
+
+    @asynccontextmanager
+    async def _writing_pair(self, key):
+        """Runs a single write of `key` after the earlier ones and after any flush writing `key`"""
+        entry = self._pair_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                while key in self._flushing:
+                    await asyncio.wait([self._flushing[key]])
+                written = self._writing[key] = asyncio.get_running_loop().create_future()
+                try:
+                    yield
+                finally:
+                    del self._writing[key]
+                    written.set_result(None)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._pair_locks[key]
+
+    async def migrate(self) -> Tuple[int, int]:
+        """Runs RecommenderCommands.migrate_ratings between flushes"""
+        async with self._flush_lock:
+            return await self.recommender_db.migrate_ratings()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Writes the pending ratings; failures are raised to the submitters waiting on them"""
+        async with self._flush_lock:
+            batch, deleted, done = self._pending, self._deleted, self._batch_done
+            self._pending, self._deleted, self._batch_done = {}, {}, None
+            if not batch:
+                # Everything pending was discarded
+                if done is not None:
+                    done.set_result((batch, deleted))
+                return
+            self._flushing.update(dict.fromkeys(batch, done))
+            try:
+                # Single writes of these pairs that already started go first
+                writing = [self._writing[key] for key in batch if key in self._writing]
+                if writing:
+                    await asyncio.wait(writing)
+                await self.recommender_db.bulk_upsert_ratings(list(batch.values()))
+                FLUSH_SIZE.observe(len(batch))
+                done.set_result((batch, deleted))
+            except Exception as e:
+                logger.error(f" Failed to flush {len(batch)} buffered ratings: {e}")
+                done.set_exception(e)
+            finally:
+                for key in batch:
+                    self._flushing.pop(key, None)
+                if not done.done():
+                    # Interrupted, e.g. cancelled on shutdown
+                    done.cancel()
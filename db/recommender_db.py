@@ -1,8 +1,32 @@
+import asyncio
+import logging
 from fastapi import HTTPException
-from typing import Optional
+from pymongo import DeleteMany, DeleteOne, ReturnDocument, UpdateOne
+from typing import Dict, Iterable, Optional
 
 from db.connections import ConnectionManager
-from models.recommendations import PreferencesModel, RatingModel
+from models.recommendations import PreferencesModel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+
+def rating_stats_delta(new_rating: Optional[int] = None, old_rating: Optional[int] = None):
+    """$inc document moving a location's aggregates from `old_rating` to `new_rating` (None = no rating)"""
+    inc = {}
+    for rating, sign in ((old_rating, -1), (new_rating, 1)):
+        if rating is None:
+            continue
+        for field, amount in (("count", 1), ("sum", rating), (f"histogram.{rating}", 1)):
+            inc[field] = inc.get(field, 0) + sign * amount
+    return {field: amount for field, amount in inc.items() if amount != 0}
+
+def merge_rating_stats_deltas(deltas: Dict[int, dict], location_id: int, delta: dict):
+    """Adds `delta` to the $inc document accumulated for `location_id` in `deltas`"""
+    inc = deltas.setdefault(location_id, {})
+    for field, amount in delta.items():
+        inc[field] = inc.get(field, 0) + amount
 
 class RecommenderCommands:
     def __init__(self, connection: Optional[ConnectionManager] = None):
@@ -10,6 +34,8 @@ class RecommenderCommands:
         self.recommender_db = self.connection.get_recommender_db()
         self.ratings_collection = self.recommender_db['ratings']
         self.preferences_collection = self.recommender_db['preferences']
+        # Running count, sum and histogram of the ratings of each location
+        self.rating_stats_collection = self.recommender_db['location_rating_stats']
 
     async def get_ratings(self):
         ratings = []
@@ -33,57 +59,196 @@ class RecommenderCommands:
             raise
         return ratings
     
-    async def add_user_rating(self, new_rating: RatingModel):
-        rating_dict = new_rating.model_dump() 
-        result = await self.ratings_collection.insert_one(rating_dict)
-        
-        if result.inserted_id is None:
-            raise HTTPException(status_code=500, detail="Failed to add rating")
-        
-        return {"message": "Rating added successfully."}
-
+    async def upsert_user_rating(self, rating_dict: dict):
+        """
+        Upserts one rating and moves its location's aggregates from the value it
+        replaced. That value comes from the write itself, so concurrent writers
+        to the same pair still produce consistent aggregates. Shielded from
+        cancellation, so the rating is never written without its aggregates.
+        """
+        return await asyncio.shield(self._upsert_user_rating(rating_dict))
 
-    async def update_user_rating(self, new_rating: RatingModel):
-        rating_dict = new_rating.model_dump()
-        result = await self.ratings_collection.update_one(
+    async def _upsert_user_rating(self, rating_dict: dict):
+        # Upsert so rating the same place twice never creates a duplicate
+        previous = await self.ratings_collection.find_one_and_update(
             {"userId": rating_dict["userId"], "locationId": rating_dict["locationId"]},
             {"$set": rating_dict},
-            upsert=True
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+            projection={"_id": 0, "rating": 1},
         )
+        old_rating = previous["rating"] if previous else None
+        await self.update_rating_stats({rating_dict["locationId"]: rating_stats_delta(rating_dict["rating"], old_rating)})
+        return previous
 
-        # Check if the update was successful
-        if result.modified_count == 0:
-            raise HTTPException(status_code=500, detail="Failed to update rating")
+    async def bulk_upsert_ratings(self, ratings: list):
+        """
+        Upserts rating dicts, whose (userId, locationId) pairs must be distinct, with
+        one unordered bulk_write. The ratings they replace are read beforehand, and
+        the aggregates of their locations are moved by the summed differences in a
+        second bulk_write. If the ratings write fails part-way, the aggregates of the
+        batch's locations are recomputed from their ratings.
+        """
+        if not ratings:
+            return 0
+        return await asyncio.shield(self._bulk_upsert_ratings(ratings))
+
+    async def _bulk_upsert_ratings(self, ratings: list):
+        pairs = [{"userId": rating["userId"], "locationId": rating["locationId"]} for rating in ratings]
+        previous = {}
+        async for document in self.ratings_collection.find({"$or": pairs}, {"_id": 0, "userId": 1, "locationId": 1, "rating": 1}):
+            previous[(document["userId"], document["locationId"])] = document["rating"]
+        
+        try:
+            await self.ratings_collection.bulk_write(
+                [UpdateOne(pair, {"$set": rating}, upsert=True) for pair, rating in zip(pairs, ratings)], ordered=False
+            )
+        except Exception:
+            await self.recompute_rating_stats({rating["locationId"] for rating in ratings})
+            raise
+        
+        deltas = {}
+        for rating in ratings:
+            old_rating = previous.get((rating["userId"], rating["locationId"]))
+            merge_rating_stats_deltas(deltas, rating["locationId"], rating_stats_delta(rating["rating"], old_rating))
+        await self.update_rating_stats(deltas)
+        return len(ratings)
 
-        return {"message": "Rating updated successfully."}
-    
     async def delete_user_rating(self, user_id: int, item_id: int):
-        is_rating_exist = await self.ratings_collection.find_one({"userId": user_id, "locationId": item_id})
+        return await asyncio.shield(self._delete_user_rating(user_id, item_id))
+
+    async def _delete_user_rating(self, user_id: int, item_id: int):
+        deleted = await self.ratings_collection.find_one_and_delete(
+            {"userId": user_id, "locationId": item_id}, projection={"_id": 0, "rating": 1}
+        )
         
-        if not is_rating_exist:
+        if not deleted:
             raise HTTPException(status_code=404, detail="Could not find rating")
         
-        delete_result = await self.ratings_collection.delete_one(is_rating_exist)
-        
-        if delete_result.deleted_count == 0:
-            raise HTTPException(status_code=500, detail="Failed to delete rating")
+        await self.update_rating_stats({item_id: rating_stats_delta(old_rating=deleted["rating"])})
         
         return {"message": "Successfully deleted user's rating."}
 
+    async def update_rating_stats(self, deltas: Dict[int, dict]):
+        """
+        Applies a $inc document per locationId in one bulk_write. When it fails, the
+        ratings were already written, so those locations are recomputed from their
+        ratings instead of being left out of line.
+        """
+        operations = [
+            UpdateOne({"locationId": location_id}, {"$inc": inc}, upsert=True)
+            for location_id, inc in deltas.items() if any(inc.values())
+        ]
+        if not operations:
+            return
+        try:
+            await self.rating_stats_collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f" Failed to update the rating aggregates of {len(operations)} locations, recomputing them: {e}")
+            await self.recompute_rating_stats(deltas.keys())
+
     async def update_preferences_collection(self, preferences: PreferencesModel):
         preferences_dict = preferences.model_dump()
         result = await self.preferences_collection.update_one({"userId": preferences_dict["userId"]}, {"$set": preferences_dict}, upsert=True)
-        if result.modified_count == 0:
+        # An upsert that inserts (first preferences of a user) modifies nothing
+        if result.matched_count == 0 and result.upserted_id is None:
             raise HTTPException(status_code=500, detail="Failed to add user preferences")
         return result
         
-    async def get_location_ratings(self, locationId: int):
+    async def get_location_ratings(self, locationId: int, skip: int = 0, limit: int = 0):
+        """A location's ratings ordered by userId; `limit=0` returns all of them"""
         ratings = []
         try:
-            cursor = self.ratings_collection.find({'locationId': locationId}, {'_id': 0})
+            cursor = self.ratings_collection.find({'locationId': locationId}, {'_id': 0}).sort('userId', 1).skip(skip).limit(limit)
             async for document in cursor:
                 ratings.append(document)
         except Exception as e:
             print(f'Error retrieving user ratings: {e}')
             raise
-        return ratings
\ No newline at end of file
+        return ratings
+
+    async def get_location_rating_stats(self, locationId: int):
+        """Maintained aggregates of a location's ratings, or None if it has none"""
+        stats = await self.rating_stats_collection.find_one({'locationId': locationId}, {'_id': 0})
+        if not stats or stats.get('count', 0) <= 0:
+            return None
+        histogram = stats.get('histogram', {})
+        return {
+            'count': stats['count'],
+            'sum': stats['sum'],
+            'histogram': {str(value): histogram.get(str(value), 0) for value in RATING_VALUES},
+        }
+
+    def rating_stats_pipeline(self, match: Optional[dict] = None):
+        """Aggregation computing the aggregates of every location matched by `match` from its ratings"""
+        histogram = {
+            f'rated{value}': {'$sum': {'$cond': [{'$eq': ['$rating', value]}, 1, 0]}} for value in RATING_VALUES
+        }
+        return ([{'$match': match}] if match else []) + [
+            {'$group': {'_id': '$locationId', 'count': {'$sum': 1}, 'sum': {'$sum': '$rating'}, **histogram}},
+            {'$project': {
+                '_id': 0, 'locationId': '$_id', 'count': 1, 'sum': 1,
+                'histogram': {str(value): f'$rated{value}' for value in RATING_VALUES},
+            }},
+        ]
+
+    async def rebuild_rating_stats(self):
+        """Recomputes every location's aggregates from the ratings collection"""
+        # $out replaces the collection in one step and keeps its indexes
+        pipeline = self.rating_stats_pipeline() + [{'$out': self.rating_stats_collection.name}]
+        await self.ratings_collection.aggregate(pipeline).to_list(None)
+        return await self.rating_stats_collection.count_documents({})
+
+    async def recompute_rating_stats(self, location_ids: Iterable[int]):
+        """Recomputes the aggregates of `location_ids` from their ratings; idempotent, so safe to retry"""
+        location_ids = list(location_ids)
+        pipeline = self.rating_stats_pipeline({'locationId': {'$in': location_ids}})
+        stats = {document['locationId']: document async for document in self.ratings_collection.aggregate(pipeline)}
+        operations = [
+            UpdateOne({'locationId': location_id}, {'$set': stats[location_id]}, upsert=True) if location_id in stats
+            else DeleteOne({'locationId': location_id})
+            for location_id in location_ids
+        ]
+        if operations:
+            await self.rating_stats_collection.bulk_write(operations, ordered=False)
+
+    async def remove_duplicate_ratings(self):
+        """Keeps the latest of the ratings stored more than once for a (userId, locationId); returns how many were removed"""
+        pipeline = [
+            {'$group': {'_id': {'userId': '$userId', 'locationId': '$locationId'}, 'ids': {'$push': '$_id'}, 'n': {'$sum': 1}}},
+            {'$match': {'n': {'$gt': 1}}},
+        ]
+        operations = []
+        async for group in self.ratings_collection.aggregate(pipeline):
+            # ObjectIds grow with insertion time
+            operations.append(DeleteMany({'_id': {'$in': sorted(group['ids'])[:-1]}}))
+        if not operations:
+            return 0
+        result = await self.ratings_collection.bulk_write(operations, ordered=False)
+        return result.deleted_count
+
+    async def migrate_ratings(self):
+        """
+        Removes duplicate ratings left by the former insert-only writes, creates the
+        indexes the upserts and aggregates rely on, and rebuilds the aggregates.
+        Modifies data, so it only runs on request (POST /admin/rating-stats/rebuild).
+        Returns the number of duplicates removed and of locations with aggregates.
+        """
+        removed = await self.remove_duplicate_ratings()
+        await self.rating_stats_collection.create_index('locationId', unique=True)
+        await self.ratings_collection.create_index([('locationId', 1), ('userId', 1)])
+        # One rating per user and location; also serves the upserts' filter
+        await self.ratings_collection.create_index([('userId', 1), ('locationId', 1)], unique=True)
+        return removed, await self.rebuild_rating_stats()
+
+    async def ratings_migrated(self):
+        """Cheap startup check that migrate_ratings has run: the unique rating index exists and aggregates are present"""
+        indexes = await self.ratings_collection.index_information()
+        unique_pair = any(
+            index.get('unique') and [field for field, _ in index['key']] == ['userId', 'locationId']
+            for index in indexes.values()
+        )
+        if not unique_pair:
+            return False
+        has_ratings = await self.ratings_collection.find_one({}, {'_id': 1}) is not None
+        return not has_ratings or await self.rating_stats_collection.find_one({}, {'_id': 1}) is not None
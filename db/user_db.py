@@ -30,14 +30,31 @@ class UserCommands:
             user_ids.append(document['userId'])
         return user_ids
     
-    async def update_user_cluster(self, user_id, cluster):
-        """Adds the cluster value for new users"""
-        result = await self.users_collection.update_one({'userId': user_id}, {'$set': {'cluster': cluster}})
+    async def get_cluster_memberships(self):
+        """userId -> cluster of every clustered user"""
+        memberships = {}
+        cursor = self.users_collection.find({'cluster': {'$ne': None}}, {'_id': 0, 'userId': 1, 'cluster': 1})
+        async for document in cursor:
+            memberships[document['userId']] = int(document['cluster'])
+        return memberships
+    
+    async def update_user_cluster(self, user_id, cluster, model_version=None):
+        """Adds the cluster value for new users, with the version of the models that computed it"""
+        result = await self.users_collection.update_one(
+            {'userId': user_id}, {'$set': {'cluster': cluster, 'clusterModel': model_version}}
+        )
         return result
 
     async def get_user_by_id(self, user_id):
         return await self.users_collection.find_one({'userId': user_id}, {'_id': 0})
 
+    async def get_user_features(self, user_id):
+        """Only the fields recommendations need: no password hash, trips or favourites"""
+        return await self.users_collection.find_one(
+            {'userId': user_id},
+            {'_id': 0, 'userId': 1, 'profile': 1, 'preferences': 1, 'cluster': 1, 'clusterModel': 1},
+        )
+
     async def get_user_by_email(self, email):
         user = await self.users_collection.find_one({'email': email}, {'_id': 0})
         if user:
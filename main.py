@@ -1,13 +1,20 @@
 import logging
+import os
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
-from routes import recommendations_router, users_router, locations_router
+from routes import recommendations_router, users_router, locations_router, metrics_router, admin_router
+from routes.admin import ADMIN_ENABLED
+from routes.encoding import default_response_class, preencoded
 from algorithms.collaborative_filter import CollaborativeFilter
 from algorithms.content_based_filter import ContentBasedFilter
 from algorithms.hybrid_filter import HybridFilter
 from algorithms.k_means_cluster import UserClusterer
+from db import RatingWriteBuffer
+from monitoring.queries import QueryAccountingMiddleware
+from monitoring.profiler import ProfilerMiddleware, profiler_state
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,11 +28,26 @@ async def lifespan(app: FastAPI):
     logger.info("   Starting Lifespan...")
     hybrid = HybridFilter()
     await hybrid.initialize()
+    if preencoded():
+        hybrid.build_encoded_rows()
     
     app.state.recommender = hybrid
+    
+    # Batches rating writes; flushed one last time on shutdown
+    rating_buffer = RatingWriteBuffer()
+    # Data migrations are an explicit admin step, so each worker only checks they ran
+    if not await rating_buffer.recommender_db.ratings_migrated():
+        logger.warning(" Ratings are not migrated: rating summaries may be missing. Run POST /admin/rating-stats/rebuild once.")
+    rating_buffer.start()
+    app.state.rating_buffer = rating_buffer
     yield
+    await rating_buffer.stop()
 
-app = FastAPI(title="Social Network based Recommender System for Tourists", lifespan=lifespan)
+app = FastAPI(
+    title="Social Network based Recommender System for Tourists",
+    lifespan=lifespan,
+    default_response_class=default_response_class(),
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +57,22 @@ app.add_middleware(
     allow_headers=["*"], 
 )
 
+# Compresses large payloads (e.g. n=100 recommendation lists) for clients that accept gzip;
+# turn off with GZIP_ENABLED=0 when a proxy in front already compresses
+if os.getenv("GZIP_ENABLED", "1") == "1":
+    app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MINIMUM_SIZE", 2048)))
+
+# Counts MongoDB round trips per request; see MONGO_QUERY_* in .env.dev
+app.add_middleware(QueryAccountingMiddleware)
+
+# Opt-in sampling profiler, only installed with PROFILING_ENABLED=1 so other deployments pay nothing
+if profiler_state.enabled:
+    app.add_middleware(ProfilerMiddleware)
+
 app.include_router(recommendations_router)
 app.include_router(users_router)
 app.include_router(locations_router)
+app.include_router(metrics_router)
+# Cache invalidation, refits and profiling are expensive or disruptive: opt-in and token-protected
+if ADMIN_ENABLED:
+    app.include_router(admin_router)
@@ -1,3 +1,3 @@
-from .locations import LocationModel
+from .locations import LocationModel, LocationSuggestionModel
 from .recommendations import RatingModel, RecommendationsModel
 from .users import UserModel, LoginRequestModel, UserResponseModel, RegisterRequestModel
\ No newline at end of file
@@ -11,3 +11,8 @@ class LocationModel(BaseModel):
     description: Optional[str] = None
     rating: Optional[float] = None
     num_ratings: Optional[float] = None
+
+class LocationSuggestionModel(BaseModel):
+    locationId: int
+    name: str
+    match: str
@@ -1,17 +1,32 @@
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
 import math
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 class RatingModel(BaseModel):
     userId: int
     locationId: int
-    rating: int
+    # Stars; the rating summaries keep one histogram bucket per value
+    rating: int = Field(ge=1, le=5)
     
 class RecommendationsRequest(BaseModel):
     userId: Optional[int] = None
     userInput: Optional[str] = None
     n: int = 20
+    # CF engine for users with ratings: "knn" (item neighbors) or "als" (matrix factorization)
+    engine: Optional[Literal["knn", "als"]] = None
+    # Only recommend locations having any ("any") or all ("all") of these categories
+    categories: Optional[List[str]] = None
+    categoryMode: Literal["any", "all"] = "any"
+    # Latency budget in milliseconds: past it, a cheaper precomputed answer is served instead
+    budgetMs: Optional[float] = None
+
+    @field_validator("budgetMs")
+    @classmethod
+    def positive_budget(cls, value):
+        if value is not None and value <= 0:
+            raise ValueError("budgetMs must be positive")
+        return value
 
 class RecommendationsModel(BaseModel):
     locationId: int
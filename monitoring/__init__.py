@@ -0,0 +1,3 @@
+from .metrics import metrics, MetricsRegistry, Counter, Gauge, Histogram, STAGE_LATENCY, BRANCH_COUNT
+from .queries import QueryAccountingMiddleware, QueryStats, current_query_stats, query_listener
+from .profiler import ProfilerMiddleware, profiler_state
\ No newline at end of file
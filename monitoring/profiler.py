@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import thread as futures_thread
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+# Loop of the threads of every ThreadPoolExecutor: asyncio.to_thread, run_in_executor and Motor's pool
+_POOL_WORKER = futures_thread._worker.__code__
+
+
+class StackSampler:
+    """
+    Samples the Python stack of one thread, and of the thread pool workers that
+    are busy, from a background thread and counts identical stacks. Worker
+    stacks are rooted at a frame naming their pool. Nothing is installed in the
+    sampled threads, so the profiled code runs unmodified apart from the GIL
+    hand-offs to the sampler.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in frames.items():
+                if thread_id == self.thread_id:
+                    self._record(frame)
+                # Idle workers wait for work in the _worker frame itself
+                elif frame.f_code is not _POOL_WORKER:
+                    self._record(frame, names.get(thread_id, "worker"))
+
+    def _record(self, frame, worker_name: str = None):
+        stack = []
+        in_pool = False
+        while frame is not None:
+            code = frame.f_code
+            in_pool = in_pool or code is _POOL_WORKER
+            stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if worker_name is not None:
+            if not in_pool:
+                return
+            # One root per pool, e.g. "asyncio_3" and "asyncio_0" both become "[asyncio threads]"
+            stack.append(f"[{worker_name.rsplit('_', 1)[0]} threads]")
+        if stack:
+            # Folded stacks go from the root frame to the leaf
+            self.samples[";".join(reversed(stack))] += 1
+
+
+class ProfilerState:
+    """Admin toggle: profile the next `armed` requests even without the header"""
+
+    def __init__(self):
+        self.enabled = os.getenv("PROFILING_ENABLED") == "1"
+        self.armed = 0
+        self.output_dir = Path(os.getenv("PROFILE_DIR", "profiles"))
+        self.interval = float(os.getenv("PROFILE_INTERVAL_MS", "1")) / 1000
+
+
+profiler_state = ProfilerState()
+
+
+class ProfilerMiddleware:
+    """
+    Captures a sampling profile of requests sent with an `X-Profile: 1` header,
+    or of the next requests armed through `POST /admin/profiler`.
+
+    Profiles are written to PROFILE_DIR in the folded-stack format read by
+    flamegraph.pl and speedscope. The event loop thread is sampled along with
+    busy thread pool workers (asyncio.to_thread scoring, Motor's I/O), whose
+    stacks sit under a "[<pool> threads]" root. Other requests running
+    concurrently on the loop or in the pools appear in the same profile.
+
+    main.py only installs this middleware when PROFILING_ENABLED=1, so regular
+    deployments do not pay for the header check either.
+    """
+
+    def __init__(self, app, state: ProfilerState = profiler_state):
+        self.app = app
+        self.state = state
+
+    def should_profile(self, scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return value == b"1"
+        if self.state.armed > 0:
+            self.state.armed -= 1
+            return True
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+        profile_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.perf_counter_ns() % 1000000:06d}_{scope['method']}_{slug}.folded"
+
+        async def send_with_profile_name(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-file", profile_name.encode())]
+            await send(message)
+
+        sampler = StackSampler(threading.get_ident(), self.state.interval)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_profile_name)
+        finally:
+            samples = sampler.stop()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            path = self.state.output_dir / profile_name
+            await asyncio.to_thread(write_folded, path, samples)
+            logger.info(f"Profiled {scope['method']} {scope['path']} ({elapsed_ms:.1f} ms, {sum(samples.values())} samples) -> {path}")
+
+
+def write_folded(path: Path, samples: Counter):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
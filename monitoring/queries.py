@@ -0,0 +1,150 @@
+import logging
+import os
+import threading
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from pymongo import monitoring
+
+from monitoring.metrics import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Connection handshake and auth commands are not queries made by our handlers
+IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions"}
+
+QUERIES_PER_REQUEST = metrics.histogram(
+    "mongo_queries_per_request",
+    "Number of MongoDB commands issued while handling one request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+BUDGET_EXCEEDED = metrics.counter(
+    "mongo_query_budget_exceeded_total",
+    "Requests that issued more MongoDB commands than their route's budget",
+    ["route"],
+)
+
+
+class QueryStats:
+    """MongoDB work done on behalf of a single request"""
+    __slots__ = ("queries", "documents", "server_time_ms", "_lock")
+
+    def __init__(self):
+        self.queries = 0
+        self.documents = 0
+        self.server_time_ms = 0.0
+        # Motor runs commands on executor threads, possibly several at once
+        self._lock = threading.Lock()
+
+    def record(self, documents: int, duration_micros: int):
+        with self._lock:
+            self.queries += 1
+            self.documents += documents
+            self.server_time_ms += duration_micros / 1000
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("mongo_query_stats", default=None)
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    """Stats for the request being handled, None outside of a request"""
+    return _current_stats.get()
+
+
+def _returned_documents(reply) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    # findAndModify returns the matched document under "value"
+    if reply.get("value") is not None:
+        return 1
+    return 0
+
+
+class QueryCounter(monitoring.CommandListener):
+    """
+    Pymongo command listener that attributes every command to the request in
+    the current context. Motor copies the context into its executor threads,
+    so commands issued while handling a request land in that request's stats.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        stats = _current_stats.get()
+        if stats is None or event.command_name in IGNORED_COMMANDS:
+            return
+        stats.record(_returned_documents(event.reply), event.duration_micros)
+
+    def failed(self, event):
+        stats = _current_stats.get()
+        if stats is None or event.command_name in IGNORED_COMMANDS:
+            return
+        stats.record(0, event.duration_micros)
+
+
+query_listener = QueryCounter()
+
+
+def parse_budgets(value: str) -> Dict[str, int]:
+    """Parses `"/recommendations/=3,/users/update-trip=1"` into a path -> budget dict"""
+    budgets = {}
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        path, _, budget = part.rpartition("=")
+        budgets[path] = int(budget)
+    return budgets
+
+
+class QueryAccountingMiddleware:
+    """
+    Tracks MongoDB queries, returned documents and server time per request.
+
+    In debug mode (MONGO_QUERY_DEBUG=1) the totals are added to the response as
+    X-Mongo-Queries, X-Mongo-Documents and X-Mongo-Time-Ms headers. Requests that
+    go over their route's budget (MONGO_QUERY_BUDGETS, falling back to
+    MONGO_QUERY_BUDGET_DEFAULT) are logged as warnings.
+    """
+
+    def __init__(self, app, debug_headers: Optional[bool] = None, budgets: Optional[Dict[str, int]] = None, default_budget: Optional[int] = None):
+        self.app = app
+        self.debug_headers = os.getenv("MONGO_QUERY_DEBUG") == "1" if debug_headers is None else debug_headers
+        self.budgets = parse_budgets(os.getenv("MONGO_QUERY_BUDGETS", "")) if budgets is None else budgets
+        if default_budget is None and os.getenv("MONGO_QUERY_BUDGET_DEFAULT"):
+            default_budget = int(os.getenv("MONGO_QUERY_BUDGET_DEFAULT"))
+        self.default_budget = default_budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _current_stats.set(stats)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-mongo-queries", str(stats.queries).encode()),
+                    (b"x-mongo-documents", str(stats.documents).encode()),
+                    (b"x-mongo-time-ms", f"{stats.server_time_ms:.2f}".encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers if self.debug_headers else send)
+        finally:
+            _current_stats.reset(token)
+            # Label unmatched paths together so 404 probes cannot blow up the metric's cardinality
+            route = scope["path"] if "endpoint" in scope else "unmatched"
+            self.check_budget(scope["method"], route, stats)
+
+    def check_budget(self, method: str, route: str, stats: QueryStats):
+        QUERIES_PER_REQUEST.observe(stats.queries, route)
+        budget = self.budgets.get(route, self.default_budget)
+        if budget is not None and stats.queries > budget:
+            BUDGET_EXCEEDED.inc(route)
+            logger.warning(f"{method} {route} made {stats.queries} MongoDB queries (budget {budget}), "
+                           f"returned {stats.documents} documents in {stats.server_time_ms:.1f} ms")
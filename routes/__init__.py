@@ -1,3 +1,5 @@
 from .recommendations import recommendations_router
 from .users import users_router
-from .locations import locations_router
\ No newline at end of file
+from .locations import locations_router
+from .metrics import metrics_router
+from .admin import admin_router
\ No newline at end of file
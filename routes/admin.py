@@ -0,0 +1,63 @@
+import hmac
+import os
+from dotenv import load_dotenv
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from typing import Optional
+
+from monitoring.profiler import profiler_state
+from routes.locations import location_cache
+
+load_dotenv()
+
+# main.py only mounts these routes with ADMIN_ENABLED=1; every call must then send ADMIN_TOKEN as X-Admin-Token
+ADMIN_ENABLED = os.getenv("ADMIN_ENABLED") == "1"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+async def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin routes need ADMIN_TOKEN to be configured.")
+    if not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Admin-Token header.")
+
+admin_router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin_token)],
+)
+
+@admin_router.post("/profiler")
+async def arm_profiler(requests: int = 1):
+    """Profiles the next `requests` requests without needing the `X-Profile: 1` header"""
+    if not profiler_state.enabled:
+        raise HTTPException(status_code=409, detail="Profiling is disabled. Start the API with PROFILING_ENABLED=1.")
+    profiler_state.armed = max(requests, 0)
+    return {"message": f"Profiling the next {profiler_state.armed} requests.", "outputDir": str(profiler_state.output_dir)}
+
+
+@admin_router.delete("/location-cache")
+async def invalidate_location_cache(locationId: Optional[int] = None):
+    """Drops cached location details for `locationId`, or every cached location when omitted"""
+    location_cache.invalidate(locationId)
+    return {"message": "Location cache invalidated.", "locationId": locationId}
+
+@admin_router.post("/clusters/refit")
+async def refit_clusters(request: Request, warmStart: bool = True, reassign: bool = False):
+    """
+    Refits the user clusters with MiniBatchKMeans over users streamed from MongoDB.
+    `warmStart` starts from the current centroids and feature pipeline;
+    `reassign` then recomputes and stores every user's cluster.
+    """
+    clusterer = request.app.state.recommender.clusterer
+    await clusterer.fit_streaming(warm_start=warmStart)
+    reassigned = len(await clusterer.recluster_all_users()) if reassign else 0
+    return {"message": "Clusters refitted.", "clusters": int(clusterer.kmeans.n_clusters), "reassignedUsers": reassigned}
+
+@admin_router.post("/rating-stats/rebuild")
+async def rebuild_rating_stats(request: Request):
+    """
+    Migrates the ratings collection: removes duplicate (userId, locationId) ratings,
+    creates the unique rating index and recomputes every location's rating count,
+    sum and histogram. Run it once per deployment, not from every worker.
+    """
+    removed, locations = await request.app.state.rating_buffer.migrate()
+    return {"message": "Rating aggregates rebuilt.", "removedDuplicates": removed, "locations": locations}
\ No newline at end of file
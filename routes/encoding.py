@@ -0,0 +1,39 @@
+import os
+from typing import Iterable
+
+from dotenv import load_dotenv
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson  # noqa: F401, optional: only speeds up the responses that are not pre-encoded
+    from fastapi.responses import ORJSONResponse
+except ImportError:
+    ORJSONResponse = None
+
+load_dotenv()
+
+# "model" validates and encodes every response through its response_model,
+# "preencoded" serves recommendation and location payloads from JSON bytes encoded once
+SERIALIZATION_MODE = os.getenv("RESPONSE_SERIALIZATION", "model")
+
+
+def preencoded() -> bool:
+    return SERIALIZATION_MODE == "preencoded"
+
+
+def default_response_class():
+    """orjson for the remaining routes when pre-encoding and orjson is installed"""
+    if preencoded() and ORJSONResponse is not None:
+        return ORJSONResponse
+    return JSONResponse
+
+
+def json_response(body: bytes, status_code: int = 200) -> Response:
+    """Sends already encoded JSON as is; the route's response_model still documents it in OpenAPI"""
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+
+def json_array(items: Iterable[bytes]) -> bytes:
+    """Concatenates encoded JSON values into a JSON array"""
+    return b"[" + b",".join(items) + b"]"
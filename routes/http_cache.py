@@ -0,0 +1,41 @@
+import hashlib
+import os
+
+from dotenv import load_dotenv
+from fastapi import Request, Response
+
+load_dotenv()
+
+# How long clients and shared caches may reuse a response before revalidating it
+CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", 300))
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag over the parts identifying a representation, e.g. data version and query, or the body bytes"""
+    digest = hashlib.sha256(b"|".join(part if isinstance(part, bytes) else str(part).encode() for part in parts)).hexdigest()[:24]
+    return f'"{digest}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """If-None-Match check; uses weak comparison as RFC 9110 requires for GET"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in header.split(","))
+
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": f"public, max-age={CACHE_MAX_AGE}"}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+def with_cache_headers(result, response: Response, etag: str):
+    """Adds the validator headers to a returned Response, or to the injected one for plain return values"""
+    target = result if isinstance(result, Response) else response
+    target.headers.update(cache_headers(etag))
+    return result
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from typing import List, Optional
 
-from models.locations import LocationModel
-from db.location_db import LocationCommands
+from models.locations import LocationModel, LocationSuggestionModel
+from db.cache import LocationCache
+from routes.encoding import json_response, preencoded
+from routes.http_cache import is_not_modified, make_etag, not_modified, with_cache_headers
 
 locations_router = APIRouter(
     prefix="/locations",
@@ -10,22 +12,39 @@ locations_router = APIRouter(
     responses={404: {"description": "Location does not exist."}},
 )
 
-location_db = LocationCommands()
+location_cache = LocationCache()
 
-@locations_router.get("/id", response_model=LocationModel)
-async def fetch_location_by_id(locationId: int):
-    location_detail = await location_db.get_location_by_id(locationId)
-    if location_detail is None:
+async def location_response(request: Request, response: Response, location_id: Optional[int]):
+    """
+    Cached location details, sent pre-encoded in the "preencoded" serialization mode.
+    The ETag is a hash of the encoded body, so every worker derives the same one
+    and it changes as soon as a refreshed cache entry has a different body.
+    """
+    encoded = await location_cache.get_encoded_by_id(location_id) if location_id is not None else None
+    if encoded is None:
         raise HTTPException(status_code=404, detail="Location not found")
     
-    location = LocationModel(**location_detail)
-    return location
+    etag = make_etag(encoded)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    location = json_response(encoded) if preencoded() else await location_cache.get_by_id(location_id)
+    return with_cache_headers(location, response, etag)
+
+@locations_router.get("/id", response_model=LocationModel)
+async def fetch_location_by_id(request: Request, response: Response, locationId: int):
+    return await location_response(request, response, locationId)
 
 @locations_router.get("/name", response_model=LocationModel)
-async def fetch_location_by_name(name: str):
-    location_detail = await location_db.get_location_by_name(name)
-    if location_detail is None:
-        raise HTTPException(status_code=404, detail="Location not found")
-    
-    location = LocationModel(**location_detail)
-    return location
\ No newline at end of file
+async def fetch_location_by_name(request: Request, response: Response, name: str):
+    """Location whose name matches exactly or by prefix; otherwise 404 listing close names as suggestions"""
+    name_index = request.app.state.recommender.name_index
+    location_id = name_index.lookup(name)
+    if location_id is None:
+        suggestions = [match._asdict() for match in name_index.search(name, limit=5)]
+        raise HTTPException(status_code=404, detail={"message": "Location not found", "suggestions": suggestions})
+    return await location_response(request, response, location_id)
+
+@locations_router.get("/autocomplete", response_model=List[LocationSuggestionModel])
+async def autocomplete_location_name(request: Request, q: str, limit: int = Query(10, ge=1, le=50)):
+    """Ranked location names for a partial or misspelled query"""
+    return [match._asdict() for match in request.app.state.recommender.name_index.search(q, limit)]
\ No newline at end of file
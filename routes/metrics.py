@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from monitoring import metrics
+
+metrics_router = APIRouter(tags=["metrics"])
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+async def fetch_metrics():
+    """Prometheus scrape endpoint with per-stage latency histograms and branch counters"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
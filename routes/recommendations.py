@@ -1,13 +1,18 @@
-from fastapi import APIRouter, HTTPException, Query, Request
+import numpy as np
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from pydantic import ValidationError, validate_call
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from db import RecommenderCommands, LocationCommands
+from db import RecommenderCommands
 from models.recommendations import RatingModel, RecommendationsModel, RecommendationsRequest
 from algorithms import HybridFilter
+from algorithms.category_index import normalize_category
+from monitoring import STAGE_LATENCY
+from routes.encoding import json_array, json_response, preencoded
+from routes.http_cache import is_not_modified, make_etag, not_modified, with_cache_headers
+from routes.locations import location_cache
 
 recommender_db = RecommenderCommands()
-location_db = LocationCommands()
 hybrid = HybridFilter()
 
 recommendations_router = APIRouter(
@@ -17,31 +22,110 @@ recommendations_router = APIRouter(
 )
 
 @recommendations_router.post("/", response_model=List[RecommendationsModel])
-async def fetch_user_recommendations(request: Request, request_body: RecommendationsRequest):
+async def fetch_user_recommendations(request: Request, response: Response, request_body: RecommendationsRequest):
+    """
+    With `budgetMs`, answers within the budget from a precomputed tier when the full
+    pipeline would not make it; the X-Recommendation-Tier header tells which tier served.
+    """
     hybrid = request.app.state.recommender
-    recommendations = await hybrid.get_recommendations(request_body.userId, request_body.userInput, request_body.n)
+    with STAGE_LATENCY.time("hybrid"):
+        recommendations, tier = await hybrid.recommend(
+            request_body.userId, request_body.userInput, request_body.n, request_body.engine,
+            request_body.categories, request_body.categoryMode, as_positions=preencoded(),
+            budget_ms=request_body.budgetMs,
+        )
     
-    # Enrich recommendations with missing fields from location_collection
-    enhanced_recommendations = []
-    for recommendation in recommendations:
-        # Assuming name can be used to find the location in the collection
-        # You might need to adjust the query based on your actual data structure
-        location_data = await location_db.get_location_by_name(recommendation["name"])
-        
-        if location_data:
-            # Add the required fields from the location data
-            if "locationId" not in recommendation and "locationId" in location_data:
-                recommendation["locationId"] = location_data["locationId"]
-                
-            if "address" not in recommendation and "address" in location_data:
-                recommendation["address"] = location_data["address"]
-            elif "address" not in recommendation:
-                # Set a placeholder address if it doesn't exist
-                recommendation["address"] = f"Address in {recommendation.get('city', 'Unknown City')}"
+    if preencoded():
+        with STAGE_LATENCY.time("serialization"):
+            result = json_response(json_array(await encode_recommendations(hybrid, recommendations)))
+    else:
+        # Enrich recommendations with missing fields from location_collection
+        with STAGE_LATENCY.time("enrichment"):
+            result = [await enrich_recommendation(hybrid, recommendation) for recommendation in recommendations]
+    
+    (result if isinstance(result, Response) else response).headers["X-Recommendation-Tier"] = tier
+    return result
+
+async def enrich_recommendation(hybrid, recommendation):
+    if "locationId" in recommendation and "address" in recommendation:
+        return recommendation
+    
+    # Resolve the name in memory, then read the (cached) location details
+    location_id = hybrid.name_index.lookup(recommendation["name"])
+    location = await location_cache.get_by_id(location_id) if location_id is not None else None
+    location_data = location.model_dump() if location else None
+    
+    if location_data:
+        # Recommendations may be the shared cached catalog rows: add the fields to a copy
+        recommendation = dict(recommendation)
+        # Add the required fields from the location data
+        if "locationId" not in recommendation and "locationId" in location_data:
+            recommendation["locationId"] = location_data["locationId"]
         
-        enhanced_recommendations.append(recommendation)
+        if "address" not in recommendation and "address" in location_data:
+            recommendation["address"] = location_data["address"]
+        elif "address" not in recommendation:
+            # Set a placeholder address if it doesn't exist
+            recommendation["address"] = f"Address in {recommendation.get('city', 'Unknown City')}"
+    return recommendation
+
+async def encode_recommendations(hybrid, recommendations):
+    """
+    JSON of each recommendation: catalog positions and catalog locations are served
+    from the pre-encoded rows, anything else is enriched and validated as usual
+    """
+    if isinstance(recommendations, np.ndarray):
+        encoded = [hybrid.encoded_at(position) for position in recommendations.tolist()]
+        if all(row is not None for row in encoded):
+            return encoded
+        # Positions outside the current catalog, e.g. computed before a reload, are dropped
+        recommendations = hybrid._records_at(recommendations[(recommendations >= 0) & (recommendations < len(hybrid.tourism_data))])
     
-    return enhanced_recommendations
+    encoded = []
+    for recommendation in recommendations:
+        row = hybrid.encoded_row(recommendation["locationId"]) if "locationId" in recommendation else None
+        if row is None:
+            try:
+                recommendation = RecommendationsModel(**await enrich_recommendation(hybrid, recommendation))
+            except ValidationError as e:
+                raise HTTPException(status_code=500, detail=f"Invalid recommendation: {e.errors()}")
+            row = recommendation.model_dump_json().encode()
+        encoded.append(row)
+    return encoded
+
+@recommendations_router.get("/popular", response_model=List[RecommendationsModel])
+async def fetch_popular_recommendations(
+    request: Request,
+    response: Response,
+    n: int = Query(20, ge=1, le=500),
+    categories: Optional[List[str]] = Query(None),
+    categoryMode: Literal["any", "all"] = "any",
+):
+    """
+    Guest popularity ranking, the same list as `POST /recommendations/` without userId or userInput.
+    Cacheable: revalidate with If-None-Match, the ETag changes when the catalog or ratings are reloaded.
+    """
+    hybrid = request.app.state.recommender
+    category_key = sorted({normalize_category(category) for category in categories}) if categories else None
+    etag = make_etag("popular", hybrid.data_version, n, category_key, categoryMode if category_key else None)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    
+    result = await fetch_user_recommendations(
+        request, response, RecommendationsRequest(n=n, categories=categories, categoryMode=categoryMode),
+    )
+    return with_cache_headers(result, response, etag)
+
+@recommendations_router.get("/facets")
+async def fetch_category_facets(
+    request: Request,
+    userInput: Optional[str] = None,
+    categories: Optional[List[str]] = Query(None),
+    categoryMode: Literal["any", "all"] = "any",
+):
+    """Location count per category, within the search input and category filter when given"""
+    hybrid = request.app.state.recommender
+    return hybrid.get_category_facets(userInput, categories, categoryMode)
 
 @recommendations_router.get("/ratings/user", response_model=List[RatingModel])
 async def fetch_user_explicit_ratings(user_id: int):
@@ -52,25 +136,58 @@ async def fetch_user_explicit_ratings(user_id: int):
 
 # TODO: Add function to add more user ratings if user saves any locations
 @recommendations_router.post("/ratings/user")
-async def add_user_rating(new_rating: RatingModel):
-    result = await recommender_db.add_user_rating(new_rating)
-    return result
+async def add_user_rating(request: Request, new_rating: RatingModel):
+    await write_rating(request, new_rating)
+    return {"message": "Rating added successfully."}
 
 @recommendations_router.patch("/ratings/user")
-async def update_user_rating(new_rating: RatingModel):
-    result = await recommender_db.update_user_rating(new_rating)
-    return result
+async def update_user_rating(request: Request, new_rating: RatingModel):
+    await write_rating(request, new_rating)
+    return {"message": "Rating updated successfully."}
+
+@recommendations_router.post("/ratings/user/bulk")
+async def add_user_ratings_bulk(request: Request, new_ratings: List[RatingModel]):
+    """
+    Adds or updates many ratings at once; later entries for the same user and location win.
+    Ratings deleted before the buffer wrote them are reported as such, not saved.
+    """
+    try:
+        saved, deleted = await request.app.state.rating_buffer.submit(new_ratings)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to save ratings: {e}")
+    message = f"{saved} ratings saved successfully."
+    if deleted:
+        message += f" {deleted} were deleted before being saved."
+    return {"message": message, "saved": saved, "deleted": deleted}
+
+async def write_rating(request: Request, rating: RatingModel):
+    """Upserts one rating right away, ordered with the buffered writes"""
+    try:
+        await request.app.state.rating_buffer.write(rating)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to save rating: {e}")
 
 @recommendations_router.delete("/ratings/user")
-async def delete_user_rating(user_id: int, item_id: int):
-    result = await recommender_db.delete_user_rating(user_id, item_id)
+async def delete_user_rating(request: Request, user_id: int, item_id: int):
+    # Through the buffer, so a pending write cannot bring the rating back
+    result = await request.app.state.rating_buffer.delete(user_id, item_id)
     return result
 
 @recommendations_router.get("/ratings/destination")
-async def fetch_destination_ratings(location_id: int):
-    ratings = await recommender_db.get_location_ratings(location_id)
-    if not ratings:
+async def fetch_destination_ratings(
+    location_id: int,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=500),
+):
+    """Rating summary of a location with one page of its individual ratings, the first `page_size` by default"""
+    stats = await recommender_db.get_location_rating_stats(location_id)
+    if not stats:
         raise HTTPException(status_code=404, detail="No ratings found")
-    avg_rating = sum(rating['rating'] for rating in ratings) / len(ratings) if ratings else 0
-    total_ratings = len(ratings)
-    return {"avgRating": avg_rating, "totalRatings": total_ratings, "ratings": ratings}
\ No newline at end of file
+    return {
+        "avgRating": stats["sum"] / stats["count"],
+        "totalRatings": stats["count"],
+        "histogram": stats["histogram"],
+        "ratings": await recommender_db.get_location_ratings(location_id, (page - 1) * page_size, page_size),
+        "page": page,
+        "pageSize": page_size,
+    }
\ No newline at end of file
@@ -1,7 +1,7 @@
 import os
 import jwt
 from datetime import datetime, timedelta, timezone
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from passlib.context import CryptContext
 
 from db.recommender_db import RecommenderCommands
@@ -22,6 +22,9 @@ recommender_db = RecommenderCommands()
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Profile fields used as clustering features, see UserClusterer.prepare_new_user
+CLUSTER_PROFILE_FIELDS = {"ageGroup", "location", "job", "gender"}
+
 def hash_password(password: str):
     return pwd_context.hash(password)
 
@@ -43,7 +46,7 @@ async def login(user: LoginRequestModel):
     return {'access_token': access_token, 'token_type': 'bearer', 'user_id': is_user_exist['userId']}
     
 @users_router.post("/auth/register")
-async def register_user(user: RegisterRequestModel):
+async def register_user(request: Request, user: RegisterRequestModel):
     """Register new users
 
     Args:
@@ -85,6 +88,7 @@ async def register_user(user: RegisterRequestModel):
     )
     
     confirm_user = await user_db.add_user(new_user)
+    await request.app.state.recommender.clusterer.observe_user(confirm_user)
     return confirm_user
 
 @users_router.get("/get-user-details", response_model=UserModel)
@@ -97,7 +101,7 @@ async def get_user_info(userId: int):
     return user
 
 @users_router.patch("/credentials", response_model=UserResponseModel)
-async def update_user_credentials(credentials: CredentialsUpdateModel):
+async def update_user_credentials(request: Request, credentials: CredentialsUpdateModel):
     update_data = credentials.model_dump(exclude_unset=True, exclude_none=True)
     
     # Hash password if provided
@@ -115,18 +119,15 @@ async def update_user_credentials(credentials: CredentialsUpdateModel):
     
     # Perform update
     result = await user_db.update_credentials(credentials.userId, update_data)
+    request.app.state.recommender.invalidate_user(credentials.userId)
     
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
     return result
 
 @users_router.patch("/profile", response_model=UserResponseModel)
-async def update_user_details(profile: ProfileUpdateModel):
+async def update_user_details(request: Request, profile: ProfileUpdateModel):
     """Updates user information in Profiles"""
-    existing_user = await user_db.get_user_by_id(profile.userId)
-    if not existing_user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     update_data = profile.model_dump(
         exclude_unset=True,
         exclude_none=True,
@@ -138,9 +139,17 @@ async def update_user_details(profile: ProfileUpdateModel):
         profile_data=update_data
     )
 
+    request.app.state.recommender.invalidate_user(profile.userId)
     if not updated_user:
+        # The update returns the document it matched, so only an empty update needs a lookup
+        if update_data or not await user_db.get_user_features(profile.userId):
+            raise HTTPException(status_code=404, detail="User not found")
         raise HTTPException(status_code=500, detail="Failed to update profile")
 
+    if CLUSTER_PROFILE_FIELDS & update_data.keys():
+        # Reassign the cluster now so cold-start recommendations never run the model
+        await request.app.state.recommender.clusterer.reassign_user(profile.userId, updated_user)
+
     updated_user = updated_user or {}
     updated_user.setdefault("profile", {})
     updated_user["userId"] = profile.userId
@@ -148,12 +157,14 @@ async def update_user_details(profile: ProfileUpdateModel):
     return UserResponseModel(**updated_user)
 
 @users_router.delete("/remove-user")
-async def remove_user(user_id: int):
+async def remove_user(request: Request, user_id: int):
     result = await user_db.delete_user(user_id)
+    request.app.state.recommender.clusterer.forget_user(user_id)
+    request.app.state.recommender.invalidate_user(user_id)
     return result
 
 @users_router.patch("/update-preferences")
-async def update_user_preferences(user_id: int, preferences: PreferencesModel):
+async def update_user_preferences(request: Request, user_id: int, preferences: PreferencesModel):
     """Updates user's preferences
     
         Example request body:\n
@@ -176,9 +187,14 @@ async def update_user_preferences(user_id: int, preferences: PreferencesModel):
     """
     preferences.userId = user_id
     user_result = await user_db.update_preferences(user_id, preferences)
+    request.app.state.recommender.invalidate_user(user_id)
     preferences_result = await recommender_db.update_preferences_collection(preferences)
     
     if user_result and preferences_result:
+        # Reassign the cluster now so cold-start recommendations never run the model
+        user_data = await user_db.get_user_features(user_id)
+        if user_data is not None:
+            await request.app.state.recommender.clusterer.reassign_user(user_id, user_data)
         return {"message": "User's preferences have been successfully updated."}
     elif not user_result:
         raise HTTPException(status_code=400, detail="Failed to update user information.")
@@ -0,0 +1,96 @@
+"""
+Recall and cost report for the approximate content similarity mode.
+
+Fits the content-based TF-IDF on the catalog, then builds a RandomProjectionLSH
+index for every parameter combination and compares its top-k neighbours with
+the exact cosine neighbours of a sample of locations:
+
+    python -m tools.ann_recall --k 10 --tables 8,16,32 --bits 8,10,12 --probes 0,2
+
+Use the printed recall@k and query latency to pick CB_ANN_TABLES, CB_ANN_BITS
+and CB_ANN_PROBES before switching CB_SIMILARITY_MODE to "ann".
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+
+import numpy as np
+
+from algorithms.ann_index import RandomProjectionLSH
+from algorithms.content_based_filter import ContentBasedFilter
+
+
+def int_list(value: str):
+    return [int(v) for v in value.split(",")]
+
+
+def exact_neighbors(matrix, row: int, k: int) -> np.ndarray:
+    scores = np.asarray((matrix @ matrix[row].T).todense()).ravel()
+    scores[row] = -np.inf
+    k = min(k, len(scores) - 1)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def index_megabytes(index: RandomProjectionLSH) -> float:
+    hasher = index.feature_hasher
+    hasher_bytes = hasher.data.nbytes + hasher.indices.nbytes + hasher.indptr.nbytes
+    return (index.sorted_rows.nbytes + index.sorted_codes.nbytes + hasher_bytes + index.planes.nbytes) / 1e6
+
+
+async def main(args):
+    cb = ContentBasedFilter()
+    # Skip the quadratic exact matrix, only the TF-IDF vectors are needed here
+    cb.similarity_mode = "ann"
+    await cb.initialize()
+    matrix = cb.ann_index.matrix
+    n_rows = matrix.shape[0]
+
+    rng = np.random.default_rng(args.seed)
+    sample = rng.choice(n_rows, size=min(args.queries, n_rows), replace=False)
+
+    started = time.perf_counter()
+    truth = {row: set(exact_neighbors(matrix, row, args.k).tolist()) for row in sample}
+    exact_ms = (time.perf_counter() - started) * 1000 / len(sample)
+
+    print(f"{n_rows} locations, {matrix.shape[1]} terms, {len(sample)} sampled queries, k={args.k}")
+    print(f"exact: dense matrix would need {n_rows * n_rows * 8 / 1e6:.1f} MB, brute-force query {exact_ms:.2f} ms\n")
+    header = f"{'tables':>6} {'bits':>5} {'probes':>6} {'build s':>8} {'index MB':>9} {'candidates':>10} {'p50 ms':>7} {'p95 ms':>7} {'recall@' + str(args.k):>10}"
+    print(header)
+    print("-" * len(header))
+
+    for n_tables, n_bits, n_probes in itertools.product(args.tables, args.bits, args.probes):
+        started = time.perf_counter()
+        index = RandomProjectionLSH(n_tables=n_tables, n_bits=n_bits, n_probes=n_probes, random_state=args.seed).fit(matrix)
+        build_seconds = time.perf_counter() - started
+
+        latencies, candidates, recalls = [], [], []
+        for row in sample:
+            started = time.perf_counter()
+            rows, _ = index.query_row(row, args.k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            candidates.append(len(index.candidates(matrix[row])))
+            if truth[row]:
+                recalls.append(len(truth[row] & set(rows.tolist())) / len(truth[row]))
+
+        print(f"{n_tables:>6} {n_bits:>5} {n_probes:>6} {build_seconds:>8.2f} {index_megabytes(index):>9.1f} "
+              f"{np.mean(candidates):>10.0f} {np.percentile(latencies, 50):>7.2f} {np.percentile(latencies, 95):>7.2f} "
+              f"{np.mean(recalls):>10.3f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Recall@k of the LSH content index against exact cosine neighbours")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled locations to query")
+    parser.add_argument("--tables", type=int_list, default=[8, 16, 32])
+    parser.add_argument("--bits", type=int_list, default=[8, 10, 12])
+    parser.add_argument("--probes", type=int_list, default=[0, 2])
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parse_args()))
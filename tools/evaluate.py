@@ -0,0 +1,315 @@
+"""
+Offline evaluation of the recommendation engines.
+
+Splits the ratings into train and test, fits every engine on the train part
+exactly as `HybridFilter` does at startup, then ranks the catalog for each
+test user and compares the top k with the user's held-out ratings:
+
+    python -m tools.evaluate --split leave-k-out --holdout 2 --k 10 --workers 8
+    python -m tools.evaluate --split temporal --test-fraction 0.2 --engines hybrid,knn,als
+
+Held-out ratings of at least --relevant are the relevant items. Reports
+precision@k, recall@k, NDCG@k and catalog coverage per engine, overall and per
+user segment, next to the per-user scoring latency. Users are scored in forked
+worker processes that share the fitted models copy-on-write (Linux/macOS).
+Set LOCAL_MONGO_URI to evaluate against a local copy of the data.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from algorithms import fusion
+from algorithms.als import ALSRecommender
+from algorithms.collaborative_filter import CollaborativeFilter
+from algorithms.content_based_filter import ContentBasedFilter
+from algorithms.hybrid_filter import HybridFilter
+from algorithms.k_means_cluster import UserClusterer
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ("popularity", "cluster", "content", "knn", "als", "hybrid")
+PERCENTILES = (50, 95, 99)
+
+# Fitted models and test data, inherited by the forked workers
+_context = {}
+
+
+def engine_list(value: str):
+    engines = value.split(",")
+    unknown = set(engines) - set(ENGINES)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown engines {sorted(unknown)}, expected some of {ENGINES}")
+    return engines
+
+
+async def load_ratings(hybrid: HybridFilter, time_field: str) -> pd.DataFrame:
+    """All ratings with a `time` column; `_id` uses the ObjectId creation time"""
+    projection = {"_id": 1, "userId": 1, "locationId": 1, "rating": 1, time_field: 1}
+    documents = await hybrid.recommender_db.ratings_collection.find({}, projection).to_list(None)
+    ratings = pd.DataFrame(documents)
+    if ratings.empty:
+        raise SystemExit("No ratings found")
+    if time_field == "_id":
+        ratings["time"] = ratings["_id"].map(lambda object_id: object_id.generation_time.timestamp())
+    else:
+        ratings["time"] = pd.to_datetime(ratings[time_field]).map(pd.Timestamp.timestamp)
+    ratings = ratings.drop_duplicates(subset=["userId", "locationId"], keep="last")
+    return ratings[["userId", "locationId", "rating", "time"]].reset_index(drop=True)
+
+
+def split_ratings(ratings: pd.DataFrame, args):
+    """(train, test): each user's `holdout` random ratings, or the most recent `test_fraction` of all ratings"""
+    if args.split == "temporal":
+        # By position rather than a time cutoff: ObjectId times only have second resolution
+        n_test = int(round(len(ratings) * args.test_fraction))
+        latest = ratings.sort_values("time", kind="stable").index[len(ratings) - n_test:]
+        test_mask = ratings.index.isin(latest)
+    else:
+        counts = ratings.groupby("userId")["locationId"].transform("size")
+        eligible = ratings[counts > args.holdout]
+        test_index = eligible.groupby("userId", group_keys=False).sample(n=args.holdout, random_state=args.seed).index
+        test_mask = ratings.index.isin(test_index)
+    return ratings[~test_mask].reset_index(drop=True), ratings[test_mask].reset_index(drop=True)
+
+
+async def build_context(args) -> dict:
+    """Fits every engine on the train split through the same code paths as HybridFilter.initialize"""
+    hybrid = HybridFilter()
+    ratings = await load_ratings(hybrid, args.time_field)
+    train, test = split_ratings(ratings, args)
+    train_ratings = train[["userId", "locationId", "rating"]]
+
+    # Neither clusters nor content use ratings, so the saved models can be reused
+    hybrid.clusterer = UserClusterer()
+    await hybrid.clusterer.initialize()
+    hybrid.cb = ContentBasedFilter()
+    await hybrid.cb.initialize_data_and_model()
+
+    hybrid.cf = CollaborativeFilter(content=hybrid.cb)
+    hybrid.cf.ratings = train_ratings
+    hybrid.cf.model.fit(train_ratings)
+    hybrid.ratings = train_ratings
+    await hybrid.load_tourism_data()
+    hybrid.als = ALSRecommender(**hybrid.als_params)
+    if not train_ratings.empty:
+        hybrid.als.fit(train_ratings)
+    hybrid.build_score_indexes()
+
+    # Cluster every user with the fitted pipeline, without writing clusters back
+    clusterer = hybrid.clusterer
+    users = await hybrid.user_db.get_all_users().to_list(None)
+    users_df = clusterer.add_text_features(clusterer.users_to_frame(users))
+    labels = clusterer.kmeans.predict(clusterer.preprocessor.transform(users_df))
+    user_cluster = dict(zip(users_df["userId"].tolist(), labels.tolist()))
+    cluster_peers = {}
+    for user_id, cluster in user_cluster.items():
+        cluster_peers.setdefault(cluster, []).append(user_id)
+
+    # userId -> catalog positions of the relevant held-out locations
+    relevant = test[test["rating"] >= args.relevant]
+    positions = hybrid.location_rows.reindex(relevant["locationId"]).to_numpy()
+    relevant = relevant.assign(position=positions)[~np.isnan(positions)]
+    relevant_positions = {
+        user_id: set(group["position"].astype(np.int64).tolist()) for user_id, group in relevant.groupby("userId")
+    }
+    if args.max_users and len(relevant_positions) > args.max_users:
+        rng = np.random.default_rng(args.seed)
+        sampled = rng.choice(sorted(relevant_positions), size=args.max_users, replace=False)
+        relevant_positions = {user_id: relevant_positions[user_id] for user_id in sampled.tolist()}
+
+    return {
+        "hybrid": hybrid,
+        "user_cluster": user_cluster,
+        "cluster_peers": cluster_peers,
+        "relevant": relevant_positions,
+        "engines": args.engines,
+        "k": args.k,
+        "split": {"type": args.split, "trainRatings": len(train), "testRatings": len(test)},
+    }
+
+
+def engine_vectors(engine: str, user_id: int, rated_positions, rated_values):
+    """(score vectors, fusion weights) of an engine; single engines are ranked on their own scores"""
+    hybrid = _context["hybrid"]
+    cluster = _context["user_cluster"].get(user_id)
+    peers = _context["cluster_peers"].get(cluster, [])
+
+    if engine == "hybrid":
+        # Same vectors and segment weights as HybridFilter.get_recommendations
+        weights = fusion.SEGMENT_WEIGHTS[fusion.user_segment(len(rated_positions))]
+        vectors = {"popularity": hybrid.popularity_prior}
+        if "cluster" in weights:
+            vectors["cluster"] = hybrid.peer_scores(peers)
+        if "content" in weights:
+            vectors["content"] = hybrid.content_scores(rated_positions, rated_values)
+        if "cf" in weights:
+            vectors["cf"] = hybrid.cf_scores(user_id, rated_positions, rated_values, hybrid.default_cf_engine)
+        return vectors, weights
+
+    if engine == "popularity":
+        scores = hybrid.popularity_prior
+    elif engine == "cluster":
+        scores = hybrid.peer_scores(peers)
+    elif engine == "content":
+        scores = hybrid.content_scores(rated_positions, rated_values)
+    else:
+        scores = hybrid.cf_scores(user_id, rated_positions, rated_values, engine)
+    if scores is not None and not np.isfinite(scores).any():
+        # Nothing scored: the engine has no opinion rather than a flat one
+        scores = None
+    return {engine: scores}, {engine: 1.0}
+
+
+def evaluate_users(user_ids: List[int]) -> List[dict]:
+    """Ranks the catalog for each user with every engine; runs inside a worker process"""
+    hybrid, k = _context["hybrid"], _context["k"]
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+    results = []
+    for user_id in user_ids:
+        rated_positions, rated_values = hybrid.user_history.get(user_id, empty)
+        relevant = _context["relevant"][user_id]
+        segment = fusion.user_segment(len(rated_positions))
+        ideal_dcg = sum(1 / np.log2(rank + 2) for rank in range(min(len(relevant), k)))
+
+        for engine in _context["engines"]:
+            started = time.perf_counter()
+            vectors, weights = engine_vectors(engine, user_id, rated_positions, rated_values)
+            try:
+                recommended = fusion.top_n(fusion.fuse_scores(vectors, weights), k, exclude=rated_positions).tolist()
+            except ValueError:
+                recommended = []
+            latency_ms = (time.perf_counter() - started) * 1000
+
+            hit_ranks = [rank for rank, position in enumerate(recommended) if position in relevant]
+            results.append({
+                "engine": engine,
+                "segment": segment,
+                "precision": len(hit_ranks) / k,
+                "recall": len(hit_ranks) / len(relevant),
+                "ndcg": sum(1 / np.log2(rank + 2) for rank in hit_ranks) / ideal_dcg,
+                "latencyMs": latency_ms,
+                "recommended": recommended,
+            })
+    return results
+
+
+def run_workers(user_ids: List[int], workers: int, chunk_size: int) -> List[dict]:
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+    if workers <= 1:
+        return [row for chunk in chunks for row in evaluate_users(chunk)]
+    # fork: workers inherit _context instead of unpickling the models
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as pool:
+        return [row for rows in pool.map(evaluate_users, chunks) for row in rows]
+
+
+def summarize(results: List[dict], n_items: int, wall_seconds: float, context: dict) -> dict:
+    frame = pd.DataFrame(results)
+    report = {
+        "k": context["k"],
+        "split": context["split"],
+        "users": int(frame.groupby("engine").size().max()) if not frame.empty else 0,
+        "wallSeconds": round(wall_seconds, 3),
+        "engines": {},
+    }
+    for engine in context["engines"]:
+        rows = frame[frame["engine"] == engine]
+        if rows.empty:
+            continue
+        latencies = rows["latencyMs"].to_numpy()
+        recommended = set(position for positions in rows["recommended"] for position in positions)
+        report["engines"][engine] = {
+            "precision": round(float(rows["precision"].mean()), 4),
+            "recall": round(float(rows["recall"].mean()), 4),
+            "ndcg": round(float(rows["ndcg"].mean()), 4),
+            "coverage": round(len(recommended) / n_items, 4) if n_items else 0.0,
+            "latencyMs": {f"p{p}": round(float(np.percentile(latencies, p)), 3) for p in PERCENTILES}
+                         | {"mean": round(float(latencies.mean()), 3)},
+            "usersPerSecond": round(1000 / latencies.mean(), 1) if latencies.mean() > 0 else None,
+            "segments": {
+                segment: {
+                    "users": len(group),
+                    "precision": round(float(group["precision"].mean()), 4),
+                    "recall": round(float(group["recall"].mean()), 4),
+                    "ndcg": round(float(group["ndcg"].mean()), 4),
+                }
+                for segment, group in rows.groupby("segment")
+            },
+        }
+    return report
+
+
+def print_report(report: dict):
+    split = report["split"]
+    k = report["k"]
+    print(f"\n{report['users']} test users, {split['type']} split ({split['trainRatings']} train / "
+          f"{split['testRatings']} test ratings), evaluated in {report['wallSeconds']}s\n")
+    header = f"{'engine':<11} {'P@' + str(k):>7} {'R@' + str(k):>7} {'NDCG@' + str(k):>8} {'coverage':>9} " + \
+             " ".join(f"{'p' + str(p) + ' ms':>9}" for p in PERCENTILES) + f" {'users/s':>9}"
+    print(header)
+    print("-" * len(header))
+    for engine, row in report["engines"].items():
+        latency = row["latencyMs"]
+        print(f"{engine:<11} {row['precision']:>7.4f} {row['recall']:>7.4f} {row['ndcg']:>8.4f} {row['coverage']:>9.3f} " +
+              " ".join(f"{latency['p' + str(p)]:>9}" for p in PERCENTILES) + f" {row['usersPerSecond']:>9}")
+
+    print(f"\nBy segment (heavy = more than {fusion.HEAVY_RATER_THRESHOLD} train ratings)\n")
+    header = f"{'engine':<11} {'segment':<11} {'users':>6} {'P@' + str(k):>7} {'R@' + str(k):>7} {'NDCG@' + str(k):>8}"
+    print(header)
+    print("-" * len(header))
+    for engine, row in report["engines"].items():
+        for segment, stats in row["segments"].items():
+            print(f"{engine:<11} {segment:<11} {stats['users']:>6} {stats['precision']:>7.4f} "
+                  f"{stats['recall']:>7.4f} {stats['ndcg']:>8.4f}")
+
+
+def main(args):
+    global _context
+    fusion.HEAVY_RATER_THRESHOLD = args.heavy_threshold
+    _context = asyncio.run(build_context(args))
+
+    user_ids = sorted(_context["relevant"])
+    if not user_ids:
+        raise SystemExit("No test users with relevant held-out ratings; try a lower --relevant or a larger test split")
+
+    started = time.perf_counter()
+    results = run_workers(user_ids, args.workers, args.chunk_size)
+    report = summarize(results, len(_context["hybrid"].tourism_data), time.perf_counter() - started, _context)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline precision/recall/NDCG/coverage and latency of the recommendation engines")
+    parser.add_argument("--split", choices=["leave-k-out", "temporal"], default="leave-k-out")
+    parser.add_argument("--holdout", type=int, default=2, help="Ratings held out per user for leave-k-out")
+    parser.add_argument("--test-fraction", type=float, default=0.2, help="Most recent share of ratings held out for temporal")
+    parser.add_argument("--time-field", default="_id",
+                        help="Rating field ordering the temporal split; '_id' uses the ObjectId creation time")
+    parser.add_argument("--relevant", type=float, default=4, help="Minimum held-out rating counted as relevant")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--engines", type=engine_list, default=list(ENGINES), help=f"Comma separated subset of {','.join(ENGINES)}")
+    parser.add_argument("--heavy-threshold", type=int, default=fusion.HEAVY_RATER_THRESHOLD,
+                        help="Ratings above which a user is 'heavy', to try other routing thresholds")
+    parser.add_argument("--max-users", type=int, default=None, help="Evaluate a random sample of this many test users")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=256, help="Users per worker task")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", default=None, help="Also write the report to this JSON file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main(parse_args())
@@ -0,0 +1,331 @@
+"""
+Load test for the recommender API.
+
+Runs the `main:app` ASGI app in-process (startup included) and drives it with a
+configurable mix of concurrent requests, then reports throughput, latency
+percentiles and error rates per scenario. Requests share one event loop with
+the app, so anything that blocks the loop shows up directly in the tail
+latencies and in the measured event loop lag.
+
+Set LOCAL_MONGO_URI so the run never touches the deployed databases:
+
+    LOCAL_MONGO_URI=mongodb://localhost:27017 python -m tools.load_test \\
+        --concurrency 32 --requests 2000 \\
+        --mix popular=4,search=3,cf=2,cold_start=1,login=1,rating=1
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIX = "popular=4,search=3,cf=2,cold_start=1,login=1,rating=1"
+PERCENTILES = (50, 95, 99)
+
+
+@dataclass
+class RequestSpec:
+    scenario: str
+    method: str
+    path: str
+    body: Optional[dict] = None
+    query: str = ""
+    expected: tuple = (200,)
+
+
+@dataclass
+class ScenarioStats:
+    route: str
+    latencies_ms: List[float] = field(default_factory=list)
+    errors: int = 0
+    status_counts: Dict[int, int] = field(default_factory=lambda: defaultdict(int))
+
+
+class ASGIClient:
+    """Minimal in-process HTTP client that calls the ASGI app directly."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, body: Optional[dict] = None, query: str = ""):
+        payload = json.dumps(body).encode() if body is not None else b""
+        headers = [(b"host", b"loadtest")]
+        if body is not None:
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": headers,
+            "client": ("127.0.0.1", 0),
+            "server": ("loadtest", 80),
+        }
+        sent = False
+        status = None
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            # Never disconnect while the app is still working on the request
+            await asyncio.Event().wait()
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            # Unhandled errors are re-raised after the 500 response has been sent
+            if status is None:
+                raise
+        return status
+
+
+class RequestPools:
+    """Ids and inputs sampled by the scenarios, read from the started app and the users collection."""
+
+    def __init__(self, recommender, users, keywords=None, login_email=None, login_password=None):
+        ratings = recommender.ratings
+        counts = ratings.groupby("userId").size() if not ratings.empty else None
+        self.cf_users = [] if counts is None else counts[counts > 15].index.tolist()
+
+        all_users = [user["userId"] for user in users]
+        rated = set() if counts is None else set(counts.index)
+        self.cold_start_users = [user_id for user_id in all_users if user_id not in rated]
+        self.rating_users = all_users
+        self.emails = [user["email"] for user in users if user.get("email")]
+
+        catalog = recommender.tourism_data
+        self.location_ids = catalog["locationId"].tolist() if "locationId" in catalog else []
+        if keywords:
+            self.keywords = keywords
+        else:
+            categories = {cat for cats in catalog.get("category", []) for cat in cats if isinstance(cat, str)}
+            self.keywords = sorted(categories) or ["museum"]
+
+        self.login_email = login_email
+        self.login_password = login_password
+
+    @classmethod
+    async def load(cls, recommender, keywords=None, login_email=None, login_password=None):
+        """Reads the users from MongoDB: the clusterer does not keep them in streaming mode"""
+        users = []
+        async for user in recommender.user_db.get_all_users():
+            users.append({"userId": user["userId"], "email": user.get("email")})
+        return cls(recommender, users, keywords, login_email, login_password)
+
+
+def build_request(scenario: str, pools: RequestPools, rnd: random.Random, n: int) -> Optional[RequestSpec]:
+    """Returns the next request for `scenario`, or None if the data cannot support it"""
+    if scenario == "popular":
+        return RequestSpec(scenario, "POST", "/recommendations/", {"userId": None, "userInput": None, "n": n})
+    if scenario == "search":
+        return RequestSpec(scenario, "POST", "/recommendations/", {"userId": None, "userInput": rnd.choice(pools.keywords), "n": n})
+    if scenario == "cf":
+        if not pools.cf_users:
+            return None
+        return RequestSpec(scenario, "POST", "/recommendations/", {"userId": rnd.choice(pools.cf_users), "userInput": None, "n": n})
+    if scenario == "cold_start":
+        if not pools.cold_start_users:
+            return None
+        return RequestSpec(scenario, "POST", "/recommendations/", {"userId": rnd.choice(pools.cold_start_users), "userInput": None, "n": n})
+    if scenario == "login":
+        if pools.login_email and pools.login_password:
+            return RequestSpec(scenario, "POST", "/users/auth/login", {"email": pools.login_email, "password": pools.login_password})
+        if not pools.emails:
+            return None
+        # Without real credentials a rejected login still exercises the password hash check
+        return RequestSpec(scenario, "POST", "/users/auth/login",
+                           {"email": rnd.choice(pools.emails), "password": "load-test"}, expected=(200, 400))
+    if scenario == "rating":
+        if not pools.rating_users or not pools.location_ids:
+            return None
+        body = {"userId": rnd.choice(pools.rating_users), "locationId": rnd.choice(pools.location_ids), "rating": rnd.randint(1, 5)}
+        return RequestSpec(scenario, "PATCH", "/recommendations/ratings/user", body)
+    raise ValueError(f"Unknown scenario '{scenario}'")
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+async def monitor_loop_lag(interval: float, lags: List[float], stop: asyncio.Event):
+    """Samples how late the event loop wakes up; large values mean something blocked it"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append((loop.time() - start - interval) * 1000)
+
+
+async def run_load(app, args) -> dict:
+    client = ASGIClient(app)
+    pools = await RequestPools.load(app.state.recommender, args.keywords, args.login_email, args.login_password)
+    rnd = random.Random(args.seed)
+
+    weights = parse_mix(args.mix)
+    for scenario in list(weights):
+        if build_request(scenario, pools, rnd, args.n) is None:
+            logger.warning(f"Skipping scenario '{scenario}': no matching data in the database")
+            del weights[scenario]
+    if not weights:
+        raise SystemExit("No runnable scenarios for this database.")
+    scenarios, scenario_weights = list(weights), list(weights.values())
+
+    stats: Dict[str, ScenarioStats] = {}
+    remaining = {"warmup": args.warmup, "requests": args.requests}
+    # Measuring starts with the first request after the warmup
+    window = {"start": None, "deadline": None}
+
+    def next_request_is_measured() -> Optional[bool]:
+        """True/False for measured/warmup requests, None once the run is over"""
+        if remaining["warmup"] > 0:
+            remaining["warmup"] -= 1
+            return False
+        if window["start"] is None:
+            window["start"] = time.perf_counter()
+            if args.duration:
+                window["deadline"] = window["start"] + args.duration
+        if window["deadline"] is not None:
+            return time.perf_counter() < window["deadline"] or None
+        if remaining["requests"] <= 0:
+            return None
+        remaining["requests"] -= 1
+        return True
+
+    async def worker():
+        while True:
+            record = next_request_is_measured()
+            if record is None:
+                return
+
+            spec = build_request(rnd.choices(scenarios, scenario_weights)[0], pools, rnd, args.n)
+            start = time.perf_counter()
+            try:
+                status = await client.request(spec.method, spec.path, spec.body, spec.query)
+            except Exception as e:
+                logger.debug(f"Request {spec.method} {spec.path} raised {e}")
+                status = None
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            if record:
+                entry = stats.setdefault(spec.scenario, ScenarioStats(route=f"{spec.method} {spec.path}"))
+                entry.latencies_ms.append(elapsed_ms)
+                entry.status_counts[status or 0] += 1
+                if status not in spec.expected:
+                    entry.errors += 1
+
+    lags: List[float] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(monitor_loop_lag(0.01, lags, stop))
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    wall_seconds = time.perf_counter() - (window["start"] or time.perf_counter())
+    stop.set()
+    await lag_task
+
+    return summarize(stats, wall_seconds, lags, args)
+
+
+def summarize(stats: Dict[str, ScenarioStats], wall_seconds: float, lags: List[float], args) -> dict:
+    report = {
+        "concurrency": args.concurrency,
+        "wallSeconds": round(wall_seconds, 3),
+        "scenarios": {},
+    }
+    total = 0
+    for scenario, entry in sorted(stats.items()):
+        latencies = np.asarray(entry.latencies_ms)
+        count = len(latencies)
+        total += count
+        report["scenarios"][scenario] = {
+            "route": entry.route,
+            "requests": count,
+            "throughput": round(count / wall_seconds, 2),
+            "errorRate": round(entry.errors / count, 4),
+            "statusCounts": dict(entry.status_counts),
+            "latencyMs": {f"p{p}": round(float(np.percentile(latencies, p)), 2) for p in PERCENTILES}
+                         | {"max": round(float(latencies.max()), 2)},
+        }
+    report["totalRequests"] = total
+    report["throughput"] = round(total / wall_seconds, 2) if wall_seconds else 0.0
+    if lags:
+        lag = np.asarray(lags)
+        report["eventLoopLagMs"] = {"p99": round(float(np.percentile(lag, 99)), 2), "max": round(float(lag.max()), 2)}
+    return report
+
+
+def print_report(report: dict):
+    print(f"\n{report['totalRequests']} requests in {report['wallSeconds']}s "
+          f"({report['throughput']} req/s, concurrency {report['concurrency']})\n")
+    header = f"{'scenario':<12} {'route':<36} {'reqs':>6} {'req/s':>8} {'err%':>6} " + \
+             " ".join(f"{'p' + str(p):>9}" for p in PERCENTILES) + f" {'max':>9}"
+    print(header)
+    print("-" * len(header))
+    for scenario, row in report["scenarios"].items():
+        latency = row["latencyMs"]
+        print(f"{scenario:<12} {row['route']:<36} {row['requests']:>6} {row['throughput']:>8} "
+              f"{row['errorRate'] * 100:>5.1f}% " +
+              " ".join(f"{latency['p' + str(p)]:>9}" for p in PERCENTILES) + f" {latency['max']:>9}")
+    if "eventLoopLagMs" in report:
+        lag = report["eventLoopLagMs"]
+        print(f"\nEvent loop lag: p99 {lag['p99']} ms, max {lag['max']} ms")
+
+
+async def main(args):
+    from main import app
+
+    # Run the app's lifespan so the recommender is initialized exactly as in production
+    async with app.router.lifespan_context(app):
+        report = await run_load(app, args)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent mixed-traffic load test for the recommender API")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="Comma separated scenario=weight pairs (popular, search, cf, cold_start, login, rating)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of requests in flight at once")
+    parser.add_argument("--requests", type=int, default=1000, help="Number of measured requests")
+    parser.add_argument("--duration", type=float, default=None, help="Run for this many seconds instead of --requests")
+    parser.add_argument("--warmup", type=int, default=50, help="Unmeasured requests sent before measuring")
+    parser.add_argument("--n", type=int, default=20, help="Number of recommendations requested")
+    parser.add_argument("--keywords", type=lambda s: s.split(","), default=None,
+                        help="Comma separated search terms (defaults to the catalog's categories)")
+    parser.add_argument("--login-email", default=None)
+    parser.add_argument("--login-password", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Also write the report to this JSON file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parse_args()))